@@ -16,7 +16,8 @@
 
 const int compressed_size = ${compressed_size};
 const int uncompressed_size = ${uncompressed_size};
-const unsigned char next_stage[] = { ${next_stage} };
+// defined by the .incbin object linked right after this file, so it follows the sizes in .rodata
+extern const unsigned char next_stage[];
 
 extern void _init;
 
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import mmap
+import struct
+from typing import NamedTuple
+
+_ELF64_HEADER = struct.Struct("<16sHHIQQQIHHHHHH")
+_ELF64_SEGMENT = struct.Struct("<IIQQQQQQ")
+_ELF64_SECTION = struct.Struct("<IIQQQQIIQQ")
+_ELF64_SYMBOL = struct.Struct("<IBBHQQ")
+
+PT_LOAD = 1
+SHT_SYMTAB = 2
+
+
+class Segment(NamedTuple):
+    vaddr: int
+    offset: int
+    filesz: int
+
+
+class Section(NamedTuple):
+    name: str
+    type: int
+    addr: int
+    offset: int
+    size: int
+    link: int
+
+
+class ElfFile:
+    """A memory-mapped little-endian ELF64 file with its sections and .symtab.
+
+    Only the headers and the symbol table are parsed; read() returns
+    memoryviews into the mapping, so nothing else is copied. Release those
+    views before close(), e.g. by leaving the `with` block without keeping any.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        ident, _, _, _, _, phoff, shoff, _, _, phentsize, phnum, shentsize, shnum, shstrndx = (
+            _ELF64_HEADER.unpack_from(self._map, 0)
+        )
+        if ident[:4] != b"\x7fELF" or ident[4] != 2 or ident[5] != 1:
+            raise ValueError(f"{path} is not a little-endian ELF64 file")
+
+        self.segments = []
+        for i in range(phnum):
+            p_type, _, p_offset, p_vaddr, _, p_filesz, _, _ = _ELF64_SEGMENT.unpack_from(
+                self._map, phoff + i * phentsize
+            )
+            if p_type == PT_LOAD:
+                self.segments.append(Segment(p_vaddr, p_offset, p_filesz))
+
+        headers = [
+            _ELF64_SECTION.unpack_from(self._map, shoff + i * shentsize) for i in range(shnum)
+        ]
+        shstrtab = headers[shstrndx][4] if headers else 0
+        self.sections = {}
+        for sh_name, sh_type, _, sh_addr, sh_offset, sh_size, sh_link, *_ in headers:
+            name = self._string(shstrtab + sh_name)
+            self.sections[name] = Section(name, sh_type, sh_addr, sh_offset, sh_size, sh_link)
+
+        self.sym = {}
+        for section in self.sections.values():
+            if section.type == SHT_SYMTAB:
+                strtab = headers[section.link][4]
+                for offset in range(section.offset, section.offset + section.size, 24):
+                    st_name, _, _, _, st_value, _ = _ELF64_SYMBOL.unpack_from(self._map, offset)
+                    if st_name:
+                        self.sym[self._string(strtab + st_name)] = st_value
+
+    def _string(self, offset):
+        return self._map[offset : self._map.find(b"\0", offset)].decode()
+
+    def offset(self, vaddr: int) -> int:
+        """Translates vaddr to a file offset through the PT_LOAD segment containing it."""
+        for segment in self.segments:
+            if segment.vaddr <= vaddr < segment.vaddr + segment.filesz:
+                return vaddr - segment.vaddr + segment.offset
+        raise ValueError(f"{vaddr:#x} is not backed by the file")
+
+    def read(self, vaddr: int, size: int) -> memoryview:
+        """Returns size bytes of the file starting at vaddr's offset.
+
+        Like pwntools' ELF.read, a range may run on past its segment into
+        whatever follows in the file.
+        """
+        offset = self.offset(vaddr)
+        if offset + size > len(self._map):
+            raise ValueError(f"{vaddr:#x}+{size:#x} runs past the end of the file")
+        return self._view[offset : offset + size]
+
+    def u32(self, vaddr: int) -> int:
+        return struct.unpack_from("<I", self._map, self.offset(vaddr))[0]
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,5 +1,11 @@
 #!/usr/bin/env python3
 
+import argparse
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
 from pathlib import Path
 from shutil import copy
 from subprocess import check_output
@@ -7,71 +13,236 @@ from tempfile import TemporaryDirectory
 from zlib import compress
 
 from mako.template import Template
-from pwn import ELF, unpack, xor
 from tqdm import trange
 
+from elf import ElfFile
+from unpack import Layout, verify_chain, xor
+
+TEMPLATE = "chall.c.mako"
+CACHE_DIR = Path(".stage_cache")
+REPORT = "build_report.json"
+SRC_DIR = Path(__file__).resolve().parent
+# the code that lays out, XORs and compresses stages
+GENERATOR_SOURCES = ("gen.py", "elf.py", "unpack.py")
+INCBIN = """\
+    .section .rodata
+    .globl next_stage
+    .type next_stage, @object
+    .balign 32
+next_stage:
+    .incbin "{payload}"
+    .size next_stage, . - next_stage
+    .section .note.GNU-stack,"",@progbits
+"""
+
+
+def stage_region(elf: ElfFile) -> memoryview:
+    """Returns the bytes from main up to the end of next_stage's payload."""
+    cur_size = elf.u32(elf.sym["compressed_size"])
+    total_size = elf.sym["next_stage"] - elf.sym["main"] + cur_size
+    return elf.read(elf.sym["main"], total_size)
+
+
+def write_stage(tmpdir, i, source: str, payload):
+    """Writes the C source and the .incbin object source for stage i; returns both paths."""
+    bin_path = Path(tmpdir) / f"stage{i}.bin"
+    asm = Path(tmpdir) / f"stage{i}_payload.s"
+    src = Path(tmpdir) / f"stage{i}.c"
+
+    bin_path.write_bytes(payload)
+    asm.write_text(INCBIN.format(payload=bin_path.as_posix()))
+    src.write_text(source)
+    return src, asm
+
+
+@contextmanager
+def timed(record, phase):
+    """Adds the seconds spent in the block to record["times"][phase]."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        times = record.setdefault("times", {})
+        times[phase] = times.get(phase, 0.0) + time.perf_counter() - start
+
+
+def compiler_command(output, src, asm, strip=False):
+    # the payload object must come right after the C object so that next_stage
+    # follows compressed_size/uncompressed_size in .rodata
+    return ["gcc", "-static", *(["-s"] if strip else []), "-w", "-o", output, src, asm, "-lz"]
+
+
+def sha256_file(path) -> str:
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def cache_key(manifest: dict) -> str:
+    return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()
+
+
+def toolchain_digest(n_stage: int) -> str:
+    """Hashes everything besides the next stage and the key chunk that goes into a stage."""
+    return cache_key(
+        {
+            "template": sha256_file(SRC_DIR / TEMPLATE),
+            "sources": {name: sha256_file(SRC_DIR / name) for name in GENERATOR_SOURCES},
+            "n_stage": n_stage,
+            "incbin": INCBIN,
+            "command": compiler_command("out", "src", "asm"),
+            "gcc": check_output(["gcc", "--version"]).decode(),
+        }
+    )
 
-def to_c_array(data):
-    return ", ".join(f"0x{b:02x}" for b in data)
 
+def build_stage(tmpdir, store: Path, i, n_stage, template, toolchain, next_stage, key, strip):
+    """Builds stage i around next_stage (None for the innermost one) into store.
+
+    The stage is named after the hash of its inputs, so an existing file is
+    reused without reading next_stage's region or compiling; its payload sizes
+    come from a .json file stored next to it. Returns the stage's path and a
+    telemetry record with the time spent in each phase and the stage's sizes.
+    """
+    record = {"stage": i, "reused": False}
+    with timed(record, "hash"):
+        stage_inputs = {
+            "toolchain": toolchain,
+            "next_stage": sha256_file(next_stage) if next_stage is not None else None,
+            "key": key.hex(),
+            "strip": strip,
+        }
+        out = store / f"{cache_key(stage_inputs)}.bin"
+    sizes = out.with_suffix(".json")
+    if out.exists() and sizes.exists():
+        record["reused"] = True
+        record.update(json.loads(sizes.read_text()))
+        record["binary_size"] = out.stat().st_size
+        return out, record
+
+    if next_stage is None:
+        payload, uncompressed = b"", b""
+    else:
+        with timed(record, "read"):
+            elf = ElfFile(next_stage)
+            pt = stage_region(elf)
+        with timed(record, "xor"):
+            uncompressed = xor(pt, key)
+        pt.release()
+        elf.close()
+        with timed(record, "compress"):
+            payload = compress(uncompressed)
+
+    with timed(record, "render"):
+        source = str(
+            template.render(
+                uncompressed_size=len(uncompressed),
+                compressed_size=len(payload),
+                n_stage=n_stage,
+            )
+        )
+    with timed(record, "write"):
+        src, asm = write_stage(tmpdir, i, source, payload)
+    tmp = out.with_suffix(f".{os.getpid()}.tmp")
+    with timed(record, "compile"):
+        check_output(compiler_command(tmp, src, asm, strip))
+    os.replace(tmp, out)
+
+    record["uncompressed_size"] = len(uncompressed)
+    record["compressed_size"] = len(payload)
+    sizes.write_text(json.dumps({k: record[k] for k in ("uncompressed_size", "compressed_size")}))
+    record["binary_size"] = out.stat().st_size
+    return out, record
+
+
+def prune_cache(store: Path, stages: list[Path]) -> int:
+    """Deletes every entry of store that stages do not use, including stray .tmp files.
+
+    Returns the number of files deleted.
+    """
+    keep = {path.name for stage in stages for path in (stage, stage.with_suffix(".json"))}
+    stale = [path for path in store.iterdir() if path.name not in keep]
+    for path in stale:
+        path.unlink()
+    return len(stale)
+
+
+def build_chain(flag: bytes, store: Path) -> tuple[list[Path], list[dict]]:
+    """Builds every stage for flag into store.
+
+    Returns the stages' paths and telemetry records, both stage 0 first.
+    """
+    n_stage = (len(flag) + 3) // 4
+    template = Template(filename=TEMPLATE)
+    toolchain = toolchain_digest(n_stage)
+    store.mkdir(exist_ok=True)
+
+    with TemporaryDirectory() as tmpdir:
+        out, record = build_stage(
+            tmpdir, store, n_stage, n_stage, template, toolchain, None, b"", False
+        )
+        stages, records = [out], [record]
+        for n in trange(n_stage, desc="Compiling"):
+            i = n_stage - n - 1
+            key = flag[i * 4 : (i + 1) * 4].ljust(4, b"\0")
+            out, record = build_stage(
+                tmpdir, store, i, n_stage, template, toolchain, out, key, i == 0
+            )
+            stages.append(out)
+            records.append(record)
 
-FLAG = Path("flag.txt").read_bytes().strip()
-N_STAGE = (len(FLAG) + 3) // 4
+    reused = sum(record["reused"] for record in records[1:])
+    print(f"[+] {reused}/{n_stage} stages reused from {store}")
+    return stages[::-1], records[::-1]
 
-template = Template(filename="chall.c.mako")
 
-with TemporaryDirectory() as tmpdir:
-    next_stage = ""
-    uncompressed_size = 0
-    compressed_size = 0
+def phase_totals(records) -> dict[str, float]:
+    totals = {}
+    for record in records:
+        for phase, elapsed in record.get("times", {}).items():
+            totals[phase] = totals.get(phase, 0.0) + elapsed
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
 
-    src = Path(tmpdir) / f"stage{N_STAGE}.c"
-    out = Path(tmpdir) / f"stage{N_STAGE}"
 
-    src.write_text(
-        str(
-            template.render(
-                uncompressed_size=uncompressed_size,
-                compressed_size=compressed_size,
-                next_stage=next_stage,
-                n_stage=N_STAGE,
-            )
-        )
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the Changing Star stage chain")
+    parser.add_argument(
+        "--no-cache", action="store_true", help=f"ignore and don't update {CACHE_DIR}"
     )
-    check_output(["gcc", "-static", "-w", "-o", out, src, "-lz"])
-
-    for n in trange(N_STAGE, desc="Compiling"):
-        i = N_STAGE - n - 1
-
-        elf = ELF(out, False)
-        cur_size = unpack(elf.read(elf.sym["compressed_size"], 4), 32)
-        total_size = elf.sym["next_stage"] - elf.sym["main"] + cur_size
-
-        pt = elf.read(elf.sym["main"], total_size)
-        key = FLAG[i * 4 : (i + 1) * 4].ljust(4, b"\0")
-
-        uncompressed = xor(pt, key)
-        uncompressed_size = len(uncompressed)
-        compressed = compress(uncompressed)
-        compressed_size = len(compressed)
-        next_stage = to_c_array(compressed)
-
-        src = Path(tmpdir) / f"stage{i}.c"
-        out = Path(tmpdir) / f"stage{i}"
-
-        src.write_text(
-            str(
-                template.render(
-                    uncompressed_size=uncompressed_size,
-                    compressed_size=compressed_size,
-                    next_stage=next_stage,
-                    n_stage=N_STAGE,
-                )
-            )
-        )
-        if i > 0:
-            check_output(["gcc", "-static", "-w", "-o", out, src, "-lz"])
-        else:
-            check_output(["gcc", "-static", "-s", "-w", "-o", out, src, "-lz"])
-
-    copy(out, "chall")
+    parser.add_argument(
+        "-r",
+        "--report",
+        default=REPORT,
+        help=f"write per-stage timings and sizes as JSON here (default: {REPORT})",
+    )
+    args = parser.parse_args()
+
+    FLAG = Path("flag.txt").read_bytes().strip()
+    start = time.perf_counter()
+
+    with TemporaryDirectory() as tmpdir:
+        stages, records = build_chain(FLAG, Path(tmpdir) if args.no_cache else CACHE_DIR)
+        if not args.no_cache:
+            print(f"[+] {prune_cache(CACHE_DIR, stages)} stale files pruned from {CACHE_DIR}")
+
+        # stage 0 is stripped, but the innermost stage has the same layout and its symbols
+        verify_start = time.perf_counter()
+        with ElfFile(stages[-1]) as elf:
+            layout = Layout.from_elf(elf)
+        problems = verify_chain(stages[0], FLAG, layout)
+        if problems:
+            raise SystemExit("\n".join(["the stage chain does not unpack:", *problems]))
+        verify_time = time.perf_counter() - verify_start
+
+        copy(stages[0], "chall")
+
+    totals = phase_totals(records)
+    print("[+] " + ", ".join(f"{phase} {elapsed:.2f}s" for phase, elapsed in totals.items()))
+    report = {
+        "flag_length": len(FLAG),
+        "n_stage": len(stages) - 1,
+        "cached": not args.no_cache,
+        "total_time": time.perf_counter() - start,
+        "verify_time": verify_time,
+        "phase_times": totals,
+        "stages": records,
+    }
+    Path(args.report).write_text(json.dumps(report, indent=2) + "\n")
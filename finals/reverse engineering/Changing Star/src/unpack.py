@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import argparse
+import struct
+import sys
+import zlib
+from pathlib import Path
+from typing import NamedTuple
+
+from elf import ElfFile
+
+# output size handed to zlib per step; a multiple of the key length keeps chunks key-aligned
+CHUNK = 1 << 16
+
+
+class Layout(NamedTuple):
+    """Addresses every stage shares, taken from a stage that still has its symbols."""
+
+    main: int
+    compressed_size: int
+    uncompressed_size: int
+    next_stage: int
+
+    @classmethod
+    def from_elf(cls, elf: ElfFile):
+        return cls(*(elf.sym[name] for name in cls._fields))
+
+
+def xor(data, key: bytes) -> bytes:
+    """XORs data with key repeated over its length, as one wide integer operation."""
+    n = len(data)
+    stream = (key * (n // len(key) + 1))[:n]
+    return (int.from_bytes(data, "little") ^ int.from_bytes(stream, "little")).to_bytes(n, "little")
+
+
+def unpack_payload(payload, key: bytes, size: int) -> bytearray:
+    """Decompresses payload in chunks and XORs each with key, as the stage loader does.
+
+    Raises ValueError unless payload is exactly one zlib stream of size bytes.
+    """
+    out = bytearray(size)
+    d = zlib.decompressobj()
+    pos = 0
+    data = payload
+    while not d.eof:
+        block = d.decompress(data, CHUNK)
+        data = d.unconsumed_tail
+        if not block:
+            raise ValueError(f"zlib stream truncated after {pos:#x} bytes")
+        if pos + len(block) > size:
+            raise ValueError(f"payload inflates past {size:#x} bytes")
+        shift = pos % len(key)
+        out[pos : pos + len(block)] = xor(block, key[shift:] + key[:shift])
+        pos += len(block)
+    if d.unused_data or data:
+        raise ValueError("trailing data after the zlib stream")
+    if pos != size:
+        raise ValueError(f"payload inflates to {pos:#x} bytes, expected {size:#x}")
+    return out
+
+
+def check_region(region, layout: Layout) -> tuple[int, int, list[str]]:
+    """Reads (compressed_size, uncompressed_size) of a stage loaded at main and checks its extent."""
+    if not layout.main < layout.next_stage or layout.next_stage % 32:
+        return 0, 0, [f"next_stage {layout.next_stage:#x} is misplaced"]
+    for field in ("compressed_size", "uncompressed_size"):
+        if not layout.main <= getattr(layout, field) <= layout.next_stage - 4:
+            return 0, 0, [f"{field} is not between main and next_stage"]
+    if len(region) < layout.next_stage - layout.main:
+        return 0, 0, [f"stage is {len(region):#x} bytes, too short to reach next_stage"]
+
+    cs, us = (
+        struct.unpack_from("<I", region, getattr(layout, field) - layout.main)[0]
+        for field in ("compressed_size", "uncompressed_size")
+    )
+    expected = layout.next_stage - layout.main + cs
+    if len(region) != expected:
+        return cs, us, [f"stage is {len(region):#x} bytes, but next_stage ends at {expected:#x}"]
+    if (cs == 0) != (us == 0):
+        return cs, us, [f"compressed_size {cs:#x} and uncompressed_size {us:#x} disagree"]
+    return cs, us, []
+
+
+def verify_chain(path, flag: bytes, layout: Layout) -> list[str]:
+    """Unpacks every stage of the binary at path in memory, the way it unpacks itself.
+
+    Returns a list of problems, empty when each stage decompresses and
+    decrypts to a well-formed next stage and the chain ends after exactly one
+    stage per 4-byte flag chunk.
+    """
+    n_stage = (len(flag) + 3) // 4
+    with ElfFile(path) as elf:
+        main = elf.sections.get(".main")
+        if main is None or main.addr != layout.main:
+            return [f"main is not at {layout.main:#x} in .main"]
+        rodata = elf.sections[".rodata"]
+        cs = elf.u32(layout.compressed_size)
+        end = layout.next_stage + cs
+        if layout.next_stage < rodata.addr or end > rodata.addr + rodata.size:
+            return ["next_stage's payload is not in .rodata"]
+        view = elf.read(layout.main, layout.next_stage - layout.main + cs)
+        region = bytes(view)
+        view.release()
+
+    for i in range(n_stage + 1):
+        cs, us, problems = check_region(region, layout)
+        if problems:
+            return [f"stage {i}: {problem}" for problem in problems]
+        if i == n_stage:
+            if cs:
+                return [f"stage {i} should be the last, but carries {cs:#x} more bytes"]
+            return []
+        if not cs:
+            return [f"stage {i} is the last, expected {n_stage}"]
+
+        key = flag[i * 4 : (i + 1) * 4].ljust(4, b"\0")
+        payload = memoryview(region)[layout.next_stage - layout.main :]
+        try:
+            region = unpack_payload(payload, key, us)
+        except (ValueError, zlib.error) as e:
+            return [f"stage {i}: {e}"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Unpack a built chall in memory and check it")
+    parser.add_argument("binary", nargs="?", default="chall")
+    parser.add_argument("-f", "--flag", default="flag.txt", help="flag the binary was built for")
+    parser.add_argument(
+        "-s", "--symbols", required=True, help="any unstripped stage of the same build"
+    )
+    args = parser.parse_args()
+
+    with ElfFile(args.symbols) as elf:
+        layout = Layout.from_elf(elf)
+    problems = verify_chain(args.binary, Path(args.flag).read_bytes().strip(), layout)
+    if problems:
+        print("\n".join(problems), file=sys.stderr)
+        sys.exit(1)
+    print(f"{args.binary}: stage chain unpacks")
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+import math
+from functools import lru_cache
+
+import numpy as np
+
+from stack_machine import Program, tea_encrypt_block_program
+
+_MASK = (1 << 64) - 1
+
+
+class BatchStackMachine:
+    """A StackMachine that runs N independent lanes in lockstep.
+
+    Every stack slot is a uint64 array with one value per lane and every lane
+    has its own memory, so a single pass over an op sequence evaluates N inputs
+    or keys at once. Arithmetic wraps at 64 bits with the semantics of
+    FixedWidthStackMachine(8): div and abs are signed and shift counts are
+    taken modulo 64.
+    """
+
+    def __init__(self, lanes, address_size=8, mem_size=0x1000):
+        self._lanes = lanes
+        self._address_size = address_size
+        self._stack: list[np.ndarray] = []
+        self._mem = np.zeros((lanes, mem_size), dtype=np.uint8)
+        self._lane_index = np.arange(lanes)[:, None]
+
+    @property
+    def lanes(self):
+        return self._lanes
+
+    def const(self, val):
+        self._stack.append(np.full(self._lanes, val & _MASK, dtype=np.uint64))
+        return self
+
+    def plus(self):
+        return self.__binary(np.add)
+
+    def minus(self):
+        return self.__binary(np.subtract)
+
+    def div(self):
+        return self.__binary(_signed_divide)
+
+    def mod(self):
+        return self.__binary(_remainder)
+
+    def mul(self):
+        return self.__binary(np.multiply)
+
+    def shl(self):
+        return self.__binary(lambda b, a: np.left_shift(b, a & np.uint64(63)))
+
+    def shr(self):
+        return self.__binary(lambda b, a: np.right_shift(b, a & np.uint64(63)))
+
+    def xor(self):
+        return self.__binary(np.bitwise_xor)
+
+    def neg(self):
+        self.__assert_elements(1)
+        self._stack[-1] = np.negative(self._stack[-1])
+        return self
+
+    def abs(self):
+        self.__assert_elements(1)
+        self._stack[-1] = np.abs(self._stack[-1].view(np.int64)).view(np.uint64)
+        return self
+
+    def bnot(self):
+        self.__assert_elements(1)
+        self._stack[-1] = np.invert(self._stack[-1])
+        return self
+
+    def band(self):
+        return self.__binary(np.bitwise_and)
+
+    def bor(self):
+        return self.__binary(np.bitwise_or)
+
+    def eq(self):
+        self.__binary(np.equal)
+        self._stack[-1] = self._stack[-1].astype(np.uint64)
+        return self
+
+    def neq(self):
+        self.__binary(np.not_equal)
+        self._stack[-1] = self._stack[-1].astype(np.uint64)
+        return self
+
+    def dup(self):
+        self.__assert_elements(1)
+        self._stack.append(self._stack[-1])
+        return self
+
+    def drop(self):
+        self.__assert_elements(1)
+        self._stack.pop()
+        return self
+
+    def pick(self, index):
+        if index >= len(self._stack):
+            raise ValueError("index out of bound")
+        self._stack.append(self._stack[-1 - index])
+        return self
+
+    def over(self):
+        self.__assert_elements(2)
+        self._stack.append(self._stack[-2])
+        return self
+
+    def swap(self):
+        self.__assert_elements(2)
+        self._stack.insert(-1, self._stack.pop())
+        return self
+
+    def rot(self):
+        self.__assert_elements(3)
+        self._stack.insert(-2, self._stack.pop())
+        return self
+
+    def deref(self):
+        return self.deref_size(self._address_size)
+
+    def deref_size(self, size):
+        if size not in (1, 2, 4, 8):
+            raise ValueError("size must be one of (1, 2, 4, 8)")
+        self.__assert_elements(1)
+        addr = self._stack.pop()
+        mem_size = self._mem.shape[1]
+        if (addr > mem_size - size).any():
+            max = f"{mem_size:x}"
+            min = "0" * len(max)
+            raise ValueError(f"address out of bound (0x{min}-0x{max})")
+        offsets = addr.astype(np.intp)[:, None] + np.arange(size)
+        vb = self._mem[self._lane_index, offsets]
+        self._stack.append(vb.view(f"<u{size}")[:, 0].astype(np.uint64))
+        return self
+
+    def store(self, address: int, value):
+        """Stores value in every lane, or one row per lane for a (lanes, n) array."""
+        value = (
+            np.frombuffer(value, dtype=np.uint8)
+            if isinstance(value, (bytes, bytearray))
+            else np.asarray(value, dtype=np.uint8)
+        )
+        self._mem[:, address : address + value.shape[-1]] = value
+
+    def execute(self, program: Program):
+        """Runs a recorded program once across all lanes."""
+        if len(self._stack) < program.min_depth:
+            raise RuntimeError(f"stack must have at least {program.min_depth} elements")
+        for method, args in _resolve(program):
+            method(self, *args)
+        return self
+
+    def lane(self, index):
+        """Returns the stack of a single lane, top first, as Python ints."""
+        return [int(slot[index]) for slot in self._stack[::-1]]
+
+    def __binary(self, fn):
+        self.__assert_elements(2)
+        a = self._stack.pop()
+        self._stack[-1] = fn(self._stack[-1], a)
+        return self
+
+    def __assert_elements(self, n):
+        if len(self._stack) < n:
+            raise RuntimeError(f"stack must have at least {n} elements")
+
+    def debug(self):
+        print(np.stack(self._stack[::-1], axis=1) if self._stack else [])
+        return self
+
+
+@lru_cache(maxsize=None)
+def _resolve(program: Program):
+    """Returns the ops of program as (unbound BatchStackMachine method, args) pairs."""
+    return tuple((getattr(BatchStackMachine, name), tuple(args)) for name, *args in program.ops)
+
+
+def _check_divisor(a):
+    if not a.all():
+        raise ZeroDivisionError("integer division or modulo by zero")
+
+
+def _signed_divide(b, a):
+    """Divides as signed 64-bit words, truncating towards zero."""
+    _check_divisor(a)
+    q = np.abs(b.view(np.int64)).view(np.uint64) // np.abs(a.view(np.int64)).view(np.uint64)
+    return np.where((a.view(np.int64) < 0) != (b.view(np.int64) < 0), np.negative(q), q)
+
+
+def _remainder(b, a):
+    _check_divisor(a)
+    return np.remainder(b, a)
+
+
+def batch_tea_encrypt(plaintexts, keys, delta=0x9E3779B9, rounds=32):
+    """Encrypts lane i of plaintexts under lane i of keys.
+
+    Both arguments are (lanes, n) uint8 arrays or sequences of equal-length
+    bytes; a single bytes value is broadcast to every lane.
+    """
+    plaintexts = _as_lanes(plaintexts)
+    keys = _as_lanes(keys)
+    lanes = max(plaintexts.shape[0], keys.shape[0])
+    block_size = 8
+    num_blocks = math.ceil(plaintexts.shape[1] / block_size)
+    machine = BatchStackMachine(lanes, mem_size=0x10 + num_blocks * block_size)
+    machine.store(0, keys[:, :0x10])
+    machine.store(0x10, plaintexts)
+    for i in range(num_blocks):
+        program = tea_encrypt_block_program(0x10 + i * block_size, 0, delta=delta, rounds=rounds)
+        machine.execute(program)
+    return machine
+
+
+def _as_lanes(data):
+    if isinstance(data, (bytes, bytearray)):
+        return np.frombuffer(data, dtype=np.uint8)[None, :]
+    if isinstance(data, np.ndarray):
+        return np.atleast_2d(data.astype(np.uint8, copy=False))
+    return np.array([np.frombuffer(row, dtype=np.uint8) for row in data])
+
+
+if __name__ == "__main__":
+    machine = batch_tea_encrypt(
+        [
+            b"ARKAV{this_chall_is_as_treacherous_as_lost_from_light!!}",
+            b"ARKAV{xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx}",
+        ],
+        bytes.fromhex("dc9e3ac003ca259f20f6a5ad6ecfbce8"),
+        delta=0x13371337,
+        rounds=8,
+    )
+    machine.debug()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import tea
+from gen_dwarf import gen_dwarf, tea_round_macro
+from stack_machine import StackMachine, tea_encrypt_block_program
+
+FLAG = b"ARKAV{this_chall_is_as_treacherous_as_lost_from_light!!}"
+KEY = bytes.fromhex("dc9e3ac003ca259f20f6a5ad6ecfbce8")
+DELTA = 0x13371337
+ROUNDS = 8
+CIPHERTEXT_WORDS = (
+    0xBE6121B7,
+    0xDF72C75,
+    0x731262C,
+    0x2F89FA84,
+    0xFF56BFE9,
+    0x1CB2B476,
+    0xABFF26E3,
+    0xCF35086B,
+    0x5791AC4C,
+    0xD5E2C222,
+    0x72DA7209,
+    0x1B0E2315,
+    0xD44D2E26,
+    0x69D6E2E0,
+)
+
+BENCHMARKS = {}
+
+
+def benchmark(unit):
+    """Registers fn as a benchmark; fn() does one unit of work and returns how many `unit`s."""
+
+    def register(fn):
+        BENCHMARKS[fn.__name__] = (fn, unit)
+        return fn
+
+    return register
+
+
+def measure(fn, min_time, repeat):
+    """Returns the best throughput of fn over `repeat` samples of at least min_time seconds."""
+    fn()  # warm caches, JIT and lazily built tables
+    best = 0.0
+    for _ in range(repeat):
+        work = 0
+        start = time.perf_counter()
+        while True:
+            work += fn()
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, work / elapsed)
+    return best
+
+
+def _stack_machine_blocks(data, jit):
+    machine = StackMachine()
+    machine.store(0, KEY)
+    machine.store(0x10, data)
+    for i in range(len(data) // 8):
+        program = tea_encrypt_block_program(0x10 + i * 8, 0, delta=DELTA, rounds=ROUNDS)
+        machine.execute(program, jit=jit)
+    return len(data) // 8
+
+
+@benchmark("blocks/s")
+def tea_encrypt_numpy():
+    data = FLAG * 64
+    tea.encrypt(data, KEY, DELTA, ROUNDS)
+    return len(data) // 8
+
+
+@benchmark("blocks/s")
+def tea_encrypt_python():
+    np, tea.np = tea.np, None
+    try:
+        tea.encrypt(FLAG, KEY, DELTA, ROUNDS)
+    finally:
+        tea.np = np
+    return len(FLAG) // 8
+
+
+@benchmark("blocks/s")
+def stack_machine_tea_encrypt():
+    return _stack_machine_blocks(FLAG, jit=False)
+
+
+@benchmark("blocks/s")
+def stack_machine_tea_encrypt_jit():
+    return _stack_machine_blocks(FLAG, jit=True)
+
+
+@benchmark("ops/s")
+def stack_machine_ops():
+    program = tea_encrypt_block_program(0x10, 0, delta=DELTA, rounds=ROUNDS)
+    machine = StackMachine()
+    machine.store(0, KEY)
+    machine.store(0x10, FLAG[:8])
+    machine.execute(program)
+    return len(program.ops)
+
+
+@benchmark("bytes/s")
+def dwarf_builder_emit():
+    tea_round_macro.cache_clear()
+    return len(gen_dwarf.__wrapped__(CIPHERTEXT_WORDS, optimized=False))
+
+
+@benchmark("bytes/s")
+def dwarf_builder_emit_optimized():
+    tea_round_macro.cache_clear()
+    return len(gen_dwarf.__wrapped__(CIPHERTEXT_WORDS))
+
+
+@benchmark("runs/s")
+def gen_chall_render():
+    """A fresh interpreter rendering chall.cpp, i.e. gen_chall.py without g++ and the cache."""
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from pathlib import Path; from gen_chall import render; "
+            "render(Path('flag.txt').read_bytes())",
+        ],
+        check=True,
+        cwd=Path(__file__).parent,
+    )
+    return 1
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, stderr=subprocess.DEVNULL
+        )
+        commit = commit.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "numpy": getattr(tea.np, "__version__", None),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Prints the change against baseline and returns the names that regressed by > threshold."""
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None or old["unit"] != result["unit"]:
+            continue
+        change = result["value"] / old["value"] - 1
+        flag = ""
+        if change < -threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"  {name:32} {change:+7.1%}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Lost from Light toolchain")
+    parser.add_argument("-o", "--output", help="write results as JSON to this file")
+    parser.add_argument("-b", "--baseline", help="JSON results to compare against")
+    parser.add_argument(
+        "-t", "--threshold", type=float, default=0.1, help="slowdown that counts as a regression"
+    )
+    parser.add_argument("-k", "--filter", default="", help="only run benchmarks containing this")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per sample")
+    parser.add_argument("--repeat", type=int, default=3, help="samples per benchmark")
+    args = parser.parse_args()
+
+    results = {}
+    for name, (fn, unit) in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        value = measure(fn, args.min_time, args.repeat)
+        results[name] = {"value": value, "unit": unit}
+        print(f"{name:34} {value:14,.1f} {unit}")
+
+    report = {"environment": environment(), "results": results}
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())["results"]
+        print(f"against {args.baseline}:")
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
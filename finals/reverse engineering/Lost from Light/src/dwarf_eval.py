@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+
+import argparse
+import struct
+import sys
+from pathlib import Path
+from typing import NamedTuple
+
+from gen_dwarf import DW_OP
+from leb128 import decode_sleb128, decode_uleb128
+from stack_machine import PagedMemory
+
+DW_OP_NAMES = {code: name for name, code in DW_OP.items()}
+
+
+class Instruction(NamedTuple):
+    offset: int
+    opcode: int
+    operands: tuple
+    size: int
+
+    @property
+    def name(self):
+        return DW_OP_NAMES[self.opcode]
+
+    def __str__(self):
+        return " ".join([f"{self.offset:#06x}: {self.name}", *map(hex, self.operands)])
+
+
+def _fixed(fmt):
+    unpack_from = struct.Struct(fmt).unpack_from
+    size = struct.calcsize(fmt)
+
+    def read(data, pos, address_size):
+        return unpack_from(data, pos), pos + size
+
+    return read
+
+
+def _no_operands(data, pos, address_size):
+    return (), pos
+
+
+def _addr(data, pos, address_size):
+    return (int.from_bytes(data[pos : pos + address_size], "little"),), pos + address_size
+
+
+def _uleb(data, pos, address_size):
+    value, pos = decode_uleb128(data, pos)
+    return (value,), pos
+
+
+def _sleb(data, pos, address_size):
+    value, pos = decode_sleb128(data, pos)
+    return (value,), pos
+
+
+def _uleb_sleb(data, pos, address_size):
+    reg, pos = decode_uleb128(data, pos)
+    offset, pos = decode_sleb128(data, pos)
+    return (reg, offset), pos
+
+
+# opcode -> operand reader; None marks opcodes that do not exist
+_OPERAND_READERS = [None] * 256
+for _name, _code in DW_OP.items():
+    _OPERAND_READERS[_code] = _no_operands
+for _name, _reader in {
+    "addr": _addr,
+    "const1u": _fixed("<B"),
+    "const1s": _fixed("<b"),
+    "const2u": _fixed("<H"),
+    "const2s": _fixed("<h"),
+    "const4u": _fixed("<I"),
+    "const4s": _fixed("<i"),
+    "const8u": _fixed("<Q"),
+    "const8s": _fixed("<q"),
+    "constu": _uleb,
+    "consts": _sleb,
+    "pick": _fixed("<B"),
+    "plus_uconst": _uleb,
+    "bra": _fixed("<h"),
+    "skip": _fixed("<h"),
+    "regx": _uleb,
+    "fbreg": _sleb,
+    "bregx": _uleb_sleb,
+    "piece": _uleb,
+    "deref_size": _fixed("<B"),
+    "xderef_size": _fixed("<B"),
+}.items():
+    _OPERAND_READERS[DW_OP[_name]] = _reader
+for _reg in range(32):
+    _OPERAND_READERS[DW_OP[f"breg{_reg}"]] = _sleb
+
+
+def decode(data: bytes, length_prefixed=False, address_size=8) -> list[Instruction]:
+    """Decodes a DWARF expression into a list of instructions.
+
+    With length_prefixed=True the expression starts with its ULEB128 length,
+    as in the DW_CFA_val_expression payload emitted into .cfi_escape.
+    """
+    pos = 0
+    end = len(data)
+    if length_prefixed:
+        length, pos = decode_uleb128(data, 0)
+        end = pos + length
+        if end > len(data):
+            raise ValueError(f"expression is truncated ({len(data) - pos} of {length} bytes)")
+    readers = _OPERAND_READERS
+    instructions = []
+    while pos < end:
+        opcode = data[pos]
+        reader = readers[opcode]
+        if reader is None:
+            raise ValueError(f"unknown DWARF operation 0x{opcode:02x} at offset {pos:#x}")
+        operands, next_pos = reader(data, pos + 1, address_size)
+        instructions.append(Instruction(pos, opcode, operands, next_pos - pos))
+        pos = next_pos
+    if pos != end:
+        raise ValueError("last operation runs past the end of the expression")
+    return instructions
+
+
+class DwarfEvaluator:
+    """Executes DWARF expressions the way libgcc's execute_stack_op does.
+
+    Values are address_size-byte words, div, shra, abs and the ordered
+    comparisons are signed, and deref/deref_size read from a PagedMemory image.
+    """
+
+    def __init__(self, memory: PagedMemory | None = None, address_size=8, registers=None):
+        self.memory = memory if memory is not None else PagedMemory(1 << (address_size * 8))
+        self.address_size = address_size
+        self.registers = registers or {}
+        self._mask = (1 << (address_size * 8)) - 1
+        self._sign_bit = 1 << (address_size * 8 - 1)
+
+    def store(self, address: int, value: bytes | bytearray):
+        self.memory.store(address, value)
+        return self
+
+    def evaluate(self, expression, initial_stack=(), length_prefixed=False, max_steps=10**7):
+        """Runs an expression (bytes or decoded instructions) and returns the top of stack.
+
+        libgcc pushes the CFA before evaluating a DW_CFA_val_expression, so pass it
+        in initial_stack when checking unwinder rules.
+        """
+        stack = self.run(expression, initial_stack, length_prefixed, max_steps)
+        if not stack:
+            raise RuntimeError("expression left an empty stack")
+        return stack[-1]
+
+    def run(self, expression, initial_stack=(), length_prefixed=False, max_steps=10**7):
+        """Like evaluate(), but returns the whole final stack, bottom first."""
+        if isinstance(expression, (bytes, bytearray, memoryview)):
+            expression = decode(expression, length_prefixed, self.address_size)
+        code = self._link(expression)
+        stack = [value & self._mask for value in initial_stack]
+        pc = 0
+        steps = 0
+        end = len(code)
+        while pc < end:
+            handler, arg = code[pc]
+            jump = handler(self, stack, arg)
+            pc = pc + 1 if jump is None else jump
+            steps += 1
+            if steps > max_steps:
+                raise RuntimeError(f"expression did not finish after {max_steps} steps")
+        return stack
+
+    def _link(self, instructions):
+        index_of = {insn.offset: i for i, insn in enumerate(instructions)}
+        if instructions:
+            last = instructions[-1]
+            index_of[last.offset + last.size] = len(instructions)
+        code = []
+        for insn in instructions:
+            handler = _HANDLERS[insn.opcode]
+            if handler is None:
+                raise ValueError(f"DW_OP_{insn.name} is not supported in CFA expressions")
+            if insn.opcode in (DW_OP["bra"], DW_OP["skip"]):
+                target = insn.offset + insn.size + insn.operands[0]
+                if target not in index_of:
+                    raise ValueError(f"branch at {insn.offset:#x} targets {target:#x}")
+                arg = index_of[target]
+            elif len(insn.operands) == 1:
+                arg = insn.operands[0]
+            else:
+                arg = insn.operands
+            code.append((handler, arg))
+        return code
+
+    def _signed(self, value):
+        return value - (value & self._sign_bit) * 2
+
+
+def _op_push(ev, s, value):
+    s.append(value & ev._mask)
+
+
+def _op_deref(ev, s, _):
+    s.append(ev.memory.load(s.pop(), ev.address_size))
+
+
+def _op_deref_size(ev, s, size):
+    s.append(ev.memory.load(s.pop(), size))
+
+
+def _op_dup(ev, s, _):
+    s.append(s[-1])
+
+
+def _op_drop(ev, s, _):
+    s.pop()
+
+
+def _op_over(ev, s, _):
+    s.append(s[-2])
+
+
+def _op_pick(ev, s, index):
+    s.append(s[-1 - index])
+
+
+def _op_swap(ev, s, _):
+    s.insert(-1, s.pop())
+
+
+def _op_rot(ev, s, _):
+    s.insert(-2, s.pop())
+
+
+def _op_abs(ev, s, _):
+    s[-1] = abs(ev._signed(s[-1])) & ev._mask
+
+
+def _op_neg(ev, s, _):
+    s[-1] = -s[-1] & ev._mask
+
+
+def _op_not(ev, s, _):
+    s[-1] = ~s[-1] & ev._mask
+
+
+def _op_plus_uconst(ev, s, value):
+    s[-1] = (s[-1] + value) & ev._mask
+
+
+def _op_breg(ev, s, arg):
+    reg, offset = arg
+    if reg not in ev.registers:
+        raise ValueError(f"register {reg} has no value")
+    s.append((ev.registers[reg] + offset) & ev._mask)
+
+
+def _op_bra(ev, s, target):
+    if s.pop() != 0:
+        return target
+
+
+def _op_skip(ev, s, target):
+    return target
+
+
+def _op_nop(ev, s, _):
+    pass
+
+
+def _binary(fn):
+    def handler(ev, s, _):
+        a = s.pop()
+        s[-1] = fn(ev, s[-1], a) & ev._mask
+
+    return handler
+
+
+def _div(ev, b, a):
+    a, b = ev._signed(a), ev._signed(b)
+    q = abs(b) // abs(a)
+    return q if (a < 0) == (b < 0) else -q
+
+
+_HANDLERS = [None] * 256
+for _name, _handler in {
+    "addr": _op_push,
+    "const1u": _op_push,
+    "const1s": _op_push,
+    "const2u": _op_push,
+    "const2s": _op_push,
+    "const4u": _op_push,
+    "const4s": _op_push,
+    "const8u": _op_push,
+    "const8s": _op_push,
+    "constu": _op_push,
+    "consts": _op_push,
+    "deref": _op_deref,
+    "deref_size": _op_deref_size,
+    "dup": _op_dup,
+    "drop": _op_drop,
+    "over": _op_over,
+    "pick": _op_pick,
+    "swap": _op_swap,
+    "rot": _op_rot,
+    "abs": _op_abs,
+    "neg": _op_neg,
+    "not": _op_not,
+    "plus_uconst": _op_plus_uconst,
+    "bregx": _op_breg,
+    "bra": _op_bra,
+    "skip": _op_skip,
+    "nop": _op_nop,
+    "and": _binary(lambda ev, b, a: b & a),
+    "or": _binary(lambda ev, b, a: b | a),
+    "xor": _binary(lambda ev, b, a: b ^ a),
+    "plus": _binary(lambda ev, b, a: b + a),
+    "minus": _binary(lambda ev, b, a: b - a),
+    "mul": _binary(lambda ev, b, a: b * a),
+    "div": _binary(_div),
+    "mod": _binary(lambda ev, b, a: b % a),
+    "shl": _binary(lambda ev, b, a: b << (a & (ev.address_size * 8 - 1))),
+    "shr": _binary(lambda ev, b, a: b >> (a & (ev.address_size * 8 - 1))),
+    "shra": _binary(lambda ev, b, a: ev._signed(b) >> (a & (ev.address_size * 8 - 1))),
+    "eq": _binary(lambda ev, b, a: b == a),
+    "ne": _binary(lambda ev, b, a: b != a),
+    "ge": _binary(lambda ev, b, a: ev._signed(b) >= ev._signed(a)),
+    "gt": _binary(lambda ev, b, a: ev._signed(b) > ev._signed(a)),
+    "le": _binary(lambda ev, b, a: ev._signed(b) <= ev._signed(a)),
+    "lt": _binary(lambda ev, b, a: ev._signed(b) < ev._signed(a)),
+}.items():
+    _HANDLERS[DW_OP[_name]] = _handler
+for _value in range(32):
+    _HANDLERS[DW_OP[f"lit{_value}"]] = lambda ev, s, _, value=_value: s.append(value)
+    _HANDLERS[DW_OP[f"breg{_value}"]] = lambda ev, s, offset, reg=_value: _op_breg(
+        ev, s, (reg, offset)
+    )
+
+
+def parse_cfi_bytes(text: str) -> bytes:
+    """Parses the comma-separated hex list printed by gen_dwarf.py."""
+    return bytes(int(token, 16) for token in text.replace("\n", "").split(",") if token.strip())
+
+
+def add_store_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "-m",
+        "--store",
+        action="append",
+        default=[],
+        metavar="ADDR=HEX",
+        help="store hex bytes at ADDR before evaluating",
+    )
+    parser.add_argument(
+        "-f",
+        "--store-file",
+        action="append",
+        default=[],
+        metavar="ADDR=PATH",
+        help="store the contents of PATH at ADDR before evaluating",
+    )
+
+
+def read_stores(args: argparse.Namespace) -> list[tuple[int, bytes]]:
+    """Returns the (address, data) pairs given with --store/--store-file."""
+    stores = []
+    for spec in args.store:
+        addr, data = spec.split("=", 1)
+        stores.append((int(addr, 0), bytes.fromhex(data)))
+    for spec in args.store_file:
+        addr, path = spec.split("=", 1)
+        stores.append((int(addr, 0), Path(path).read_bytes()))
+    return stores
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Evaluate a length-prefixed DWARF expression as printed by gen_dwarf.py"
+    )
+    parser.add_argument("expression", nargs="?", help="file with the expression (default: stdin)")
+    add_store_arguments(parser)
+    parser.add_argument("-c", "--cfa", type=lambda v: int(v, 0), default=0, help="initial CFA")
+    parser.add_argument("-d", "--disassemble", action="store_true", help="print the decoded ops")
+    args = parser.parse_args()
+
+    text = Path(args.expression).read_text() if args.expression else sys.stdin.read()
+    instructions = decode(parse_cfi_bytes(text), length_prefixed=True)
+    if args.disassemble:
+        print("\n".join(map(str, instructions)))
+
+    evaluator = DwarfEvaluator()
+    for addr, data in read_stores(args):
+        evaluator.store(addr, data)
+    print(hex(evaluator.evaluate(instructions, initial_stack=[args.cfa])))
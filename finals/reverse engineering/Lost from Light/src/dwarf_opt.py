@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+from dwarf_eval import (
+    DW_OP_NAMES,
+    DwarfEvaluator,
+    Instruction,
+    add_store_arguments,
+    decode,
+    parse_cfi_bytes,
+    read_stores,
+)
+from gen_dwarf import DW_OP, DwarfExpressionBuilder
+from leb128 import decode_uleb128, encode_sleb128, encode_uleb128
+from stack_machine import PagedMemory
+
+_CONST_OPS = {
+    "addr",
+    "const1u",
+    "const1s",
+    "const2u",
+    "const2s",
+    "const4u",
+    "const4s",
+    "const8u",
+    "const8s",
+    "constu",
+    "consts",
+    *(f"lit{n}" for n in range(32)),
+}
+_UNARY_OPS = {"abs", "neg", "not", "plus_uconst"}
+_BINARY_OPS = {
+    "and",
+    "div",
+    "minus",
+    "mod",
+    "mul",
+    "or",
+    "plus",
+    "shl",
+    "shr",
+    "shra",
+    "xor",
+    "eq",
+    "ge",
+    "gt",
+    "le",
+    "lt",
+    "ne",
+}
+# x op 0 == x
+_ZERO_IDENTITY_OPS = {"plus", "minus", "or", "xor", "shl", "shr", "shra"}
+# sequences that leave the stack exactly as they found it
+_NOOP_SEQUENCES = [
+    ("rot", "rot", "rot"),
+    ("swap", "swap"),
+    ("dup", "drop"),
+    ("over", "drop"),
+    ("pick", "drop"),
+]
+
+
+class _Node:
+    __slots__ = ("name", "operands", "target")
+
+    def __init__(self, name, operands=(), target=None):
+        self.name = name
+        self.operands = operands
+        self.target = target
+
+
+def _const(value):
+    return _Node("constu", (value,))
+
+
+class _Optimizer:
+    def __init__(self, address_size):
+        self.address_size = address_size
+        self.mask = (1 << (address_size * 8)) - 1
+        self.evaluator = DwarfEvaluator(PagedMemory(0), address_size)
+
+    def const_value(self, node):
+        if node.name.startswith("lit"):
+            return int(node.name[3:])
+        return node.operands[0] & self.mask
+
+    def fold(self, nodes):
+        """Evaluates a branch-free, memory-free run of nodes on an empty stack."""
+        instructions = [
+            Instruction(i, DW_OP[node.name], node.operands, 1) for i, node in enumerate(nodes)
+        ]
+        try:
+            (value,) = self.evaluator.run(instructions)
+        except (ZeroDivisionError, ValueError):
+            return None
+        return [_const(value)]
+
+    def rewrite(self, nodes, i):
+        """Returns (consumed, replacement) for a peephole match at nodes[i], or None."""
+        names = [node.name for node in nodes[i : i + 3]]
+        first = names[0]
+        for sequence in _NOOP_SEQUENCES:
+            if tuple(names[: len(sequence)]) == sequence:
+                return len(sequence), []
+        if first == "pick" and nodes[i].operands[0] < 2:
+            return 1, [_Node("dup" if nodes[i].operands[0] == 0 else "over")]
+        if first == "plus_uconst" and nodes[i].operands[0] & self.mask == 0:
+            return 1, []
+        if names[:2] == ["plus_uconst", "plus_uconst"]:
+            value = (nodes[i].operands[0] + nodes[i + 1].operands[0]) & self.mask
+            return 2, [_Node("plus_uconst", (value,))]
+        if first not in _CONST_OPS or len(names) < 2:
+            return None
+        second = names[1]
+        if second == "drop":
+            return 2, []
+        if second in _UNARY_OPS:
+            folded = self.fold(nodes[i : i + 2])
+            return None if folded is None else (2, folded)
+        value = self.const_value(nodes[i])
+        if value == 0 and second in _ZERO_IDENTITY_OPS:
+            return 2, []
+        if second == "plus" and len(encode_uleb128(value)) <= len(self.encode_const(value)[1]):
+            return 2, [_Node("plus_uconst", (value,))]
+        if second in _CONST_OPS and len(names) == 3 and names[2] in _BINARY_OPS:
+            folded = self.fold(nodes[i : i + 3])
+            return None if folded is None else (3, folded)
+        return None
+
+    def run(self, nodes):
+        # branch target -> the bra/skip nodes jumping to it; no rewrite removes a branch
+        branches = {}
+        for node in nodes:
+            if node.target is not None:
+                branches.setdefault(node.target, []).append(node)
+        i = 0
+        while i < len(nodes):
+            match = self.rewrite(nodes, i)
+            if match is not None:
+                consumed, replacement = match
+                if any(node in branches for node in nodes[i + 1 : i + consumed]):
+                    match = None
+            if match is None:
+                i += 1
+                continue
+            head = nodes[i]
+            if replacement:
+                # keep the head node object so branches into it stay valid
+                head.name, head.operands = replacement[0].name, replacement[0].operands
+                nodes[i + 1 : i + consumed] = replacement[1:]
+            else:
+                following = nodes[i + consumed] if i + consumed < len(nodes) else _END
+                for node in branches.pop(head, ()):
+                    node.target = following
+                    branches.setdefault(following, []).append(node)
+                del nodes[i : i + consumed]
+            i = max(i - 2, 0)
+        return nodes
+
+    def encode_const(self, value):
+        """Returns the shortest (name, operand bytes) pushing value as a word."""
+        signed = value - ((value >> (self.address_size * 8 - 1)) << (self.address_size * 8))
+        candidates = []
+        if value < 32:
+            candidates.append((f"lit{value}", b""))
+        for name, size, low, high, v in (
+            ("const1u", 1, 0, 0xFF, value),
+            ("const1s", 1, -0x80, 0x7F, signed),
+            ("const2u", 2, 0, 0xFFFF, value),
+            ("const2s", 2, -0x8000, 0x7FFF, signed),
+            ("const4u", 4, 0, 0xFFFFFFFF, value),
+            ("const4s", 4, -0x80000000, 0x7FFFFFFF, signed),
+        ):
+            if low <= v <= high:
+                candidates.append((name, v.to_bytes(size, "little", signed=v < 0)))
+        candidates.append(("constu", encode_uleb128(value)))
+        candidates.append(("consts", encode_sleb128(signed)))
+        candidates.append(("const8u", value.to_bytes(8, "little")))
+        return min(candidates, key=lambda c: 1 + len(c[1]))
+
+    def emit(self, nodes):
+        builder = DwarfExpressionBuilder(self.address_size)
+        labels = {id(node.target): builder.label() for node in nodes if node.target is not None}
+        for node in nodes:
+            if id(node) in labels:
+                builder.place(labels[id(node)])
+            name = node.name
+            if name in ("bra", "skip"):
+                getattr(builder, name)(labels[id(node.target)])
+            elif name in _CONST_OPS:
+                op, operand = self.encode_const(self.const_value(node))
+                builder.op(op, operand)
+            elif name in ("and", "or", "not"):
+                getattr(builder, f"b{name}")()
+            elif name.startswith("breg") and name != "bregx":
+                builder.breg(int(name[4:]), *node.operands)
+            elif name == "bregx":
+                builder.breg(*node.operands)
+            elif name.startswith("reg"):
+                builder.reg(int(name[3:]) if name != "regx" else node.operands[0])
+            elif node.operands:
+                getattr(builder, name)(*node.operands)
+            else:
+                builder.op(name)
+        if id(_END) in labels:
+            builder.place(labels[id(_END)])
+        return builder.get_bytes()
+
+
+_END = _Node("end")
+
+
+def optimize(expression: bytes, address_size=8) -> bytes:
+    """Returns a shorter expression with the same result as expression.
+
+    Constants are re-encoded with their shortest form, constant arithmetic is
+    folded, and stack no-ops such as rot;rot;rot, swap;swap and over;drop are
+    dropped. Rewrites never span a branch target; bra/skip offsets are
+    recomputed for the new layout.
+    """
+    instructions = decode(expression, address_size=address_size)
+    by_offset = {}
+    nodes = []
+    for insn in instructions:
+        node = _Node(DW_OP_NAMES[insn.opcode], insn.operands)
+        by_offset[insn.offset] = node
+        nodes.append(node)
+    by_offset[len(expression)] = _END
+    for insn, node in zip(instructions, nodes):
+        if node.name in ("bra", "skip"):
+            node.target = by_offset[insn.offset + insn.size + insn.operands[0]]
+            node.operands = ()
+    optimizer = _Optimizer(address_size)
+    return optimizer.emit(optimizer.run(nodes))
+
+
+def check_equivalent(original: bytes, optimized: bytes, images, address_size=8):
+    """Runs both expressions on every (memory, initial_stack) image and compares final stacks."""
+    for memory, initial_stack in images:
+        expected = DwarfEvaluator(memory, address_size).run(original, initial_stack)
+        actual = DwarfEvaluator(memory, address_size).run(optimized, initial_stack)
+        if expected != actual:
+            raise ValueError(f"optimized expression differs: {actual} != {expected}")
+
+
+def random_images(stores, count, initial_stack=(0,)):
+    """Yields the image built from stores, then count images with the stored ranges randomised."""
+    for n in range(count + 1):
+        memory = PagedMemory(1 << 64)
+        for addr, data in stores:
+            memory.store(addr, data if n == 0 else os.urandom(len(data)))
+        yield memory, initial_stack
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Optimize a length-prefixed DWARF expression as printed by gen_dwarf.py"
+    )
+    parser.add_argument("expression", nargs="?", help="file with the expression (default: stdin)")
+    add_store_arguments(parser)
+    parser.add_argument(
+        "-n", "--trials", type=int, default=16, help="random memory images to compare on"
+    )
+    args = parser.parse_args()
+
+    text = Path(args.expression).read_text() if args.expression else sys.stdin.read()
+    data = parse_cfi_bytes(text)
+    length, pos = decode_uleb128(data)
+    original = data[pos : pos + length]
+    optimized = optimize(original)
+    check_equivalent(original, optimized, random_images(read_stores(args), args.trials))
+    print(f"{len(original)} -> {len(optimized)} bytes", file=sys.stderr)
+    print(",".join(map(hex, [*encode_uleb128(len(optimized)), *optimized])))
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+
+import argparse
+import mmap
+import struct
+import sys
+from pathlib import Path
+from typing import NamedTuple
+
+from dwarf_eval import decode
+from leb128 import decode_sleb128, decode_uleb128
+
+DW_CFA_val_expression = 0x16
+RIP = 16
+
+_ELF64_HEADER = struct.Struct("<16sHHIQQQIHHHHHH")
+_ELF64_SECTION = struct.Struct("<IIQQQQIIQQ")
+
+
+class Section(NamedTuple):
+    name: str
+    addr: int
+    offset: int
+    size: int
+
+
+def read_sections(data) -> dict[str, Section]:
+    """Parses the section headers of a little-endian ELF64 image."""
+    ident, _, _, _, _, _, shoff, _, _, _, _, shentsize, shnum, shstrndx = _ELF64_HEADER.unpack_from(
+        data, 0
+    )
+    if ident[:4] != b"\x7fELF" or ident[4] != 2 or ident[5] != 1:
+        raise ValueError("not a little-endian ELF64 file")
+    headers = [_ELF64_SECTION.unpack_from(data, shoff + i * shentsize) for i in range(shnum)]
+    strtab = headers[shstrndx][4]
+    sections = {}
+    for name, _, _, addr, offset, size, *_ in headers:
+        end = data.find(b"\0", strtab + name)
+        key = bytes(data[strtab + name : end]).decode()
+        sections[key] = Section(key, addr, offset, size)
+    return sections
+
+
+# DW_EH_PE_* value formats: low nibble -> (struct format or None for LEB128, signed)
+_POINTER_FORMATS = {
+    0x00: ("<Q", False),
+    0x01: (None, False),
+    0x02: ("<H", False),
+    0x03: ("<I", False),
+    0x04: ("<Q", False),
+    0x09: (None, True),
+    0x0A: ("<h", True),
+    0x0B: ("<i", True),
+    0x0C: ("<q", True),
+}
+DW_EH_PE_omit = 0xFF
+DW_EH_PE_pcrel = 0x10
+DW_EH_PE_indirect = 0x80
+
+
+def read_pointer(data, pos, encoding, section: Section, base):
+    """Reads a DW_EH_PE-encoded pointer at data[pos]; base is the section's offset in data."""
+    fmt, signed = _POINTER_FORMATS[encoding & 0x0F]
+    start = pos
+    if fmt is None:
+        value, pos = (decode_sleb128 if signed else decode_uleb128)(data, pos)
+    else:
+        (value,) = struct.unpack_from(fmt, data, pos)
+        pos += struct.calcsize(fmt)
+    if encoding & 0x70 == DW_EH_PE_pcrel:
+        value += section.addr + (start - base)
+    return value & 0xFFFFFFFFFFFFFFFF, pos
+
+
+class Cie(NamedTuple):
+    offset: int
+    augmentation: str
+    code_align: int
+    data_align: int
+    return_register: int
+    fde_encoding: int
+    instructions: memoryview
+
+
+class Fde(NamedTuple):
+    offset: int
+    cie: Cie
+    pc_begin: int
+    pc_range: int
+    instructions: memoryview
+
+
+def _parse_cie(data, offset, pos, end, section, base) -> Cie:
+    version = data[pos]
+    aug_end = data.find(b"\0", pos + 1)
+    augmentation = bytes(data[pos + 1 : aug_end]).decode()
+    pos = aug_end + 1
+    if "eh" in augmentation:
+        pos += 8
+    code_align, pos = decode_uleb128(data, pos)
+    data_align, pos = decode_sleb128(data, pos)
+    if version == 1:
+        return_register, pos = data[pos], pos + 1
+    else:
+        return_register, pos = decode_uleb128(data, pos)
+    fde_encoding = 0
+    if augmentation.startswith("z"):
+        length, pos = decode_uleb128(data, pos)
+        aug_data, after = pos, pos + length
+        for c in augmentation[1:]:
+            if c == "R":
+                fde_encoding, aug_data = data[aug_data], aug_data + 1
+            elif c == "P":
+                _, aug_data = read_pointer(
+                    data, aug_data + 1, data[aug_data] & ~DW_EH_PE_indirect, section, base
+                )
+            elif c == "L":
+                aug_data += 1
+        pos = after
+    view = memoryview(data)[pos:end]
+    return Cie(offset, augmentation, code_align, data_align, return_register, fde_encoding, view)
+
+
+def _read_length(data, pos):
+    """Reads a record's initial length, in the 32-bit or 0xffffffff-prefixed 64-bit form.
+
+    Returns (length, position after the length field).
+    """
+    (length,) = struct.unpack_from("<I", data, pos)
+    if length == 0xFFFFFFFF:
+        (length,) = struct.unpack_from("<Q", data, pos + 4)
+        return length, pos + 12
+    return length, pos + 4
+
+
+def iter_fdes(data, section: Section):
+    """Walks the CIE/FDE records of an .eh_frame section mapped at data[section.offset].
+
+    Instruction streams are returned as memoryviews into data, so nothing is
+    copied out of the mapping.
+    """
+    base = section.offset
+    pos = base
+    end = base + section.size
+    cies = {}
+    while pos < end:
+        record = pos
+        length, pos = _read_length(data, pos)
+        if length == 0:
+            # zero terminator
+            break
+        record_end = pos + length
+        id_pos = pos
+        (cie_id,) = struct.unpack_from("<I", data, pos)
+        pos += 4
+        if cie_id == 0:
+            cies[record] = _parse_cie(data, record - base, pos, record_end, section, base)
+        else:
+            cie_pos = id_pos - cie_id
+            cie = cies.get(cie_pos)
+            if cie is None:
+                # a CIE outside the walked range; its bounds come from its own header
+                cie_length, cie_id_pos = _read_length(data, cie_pos)
+                cie_end = cie_id_pos + cie_length
+                cie = _parse_cie(data, cie_pos - base, cie_id_pos + 4, cie_end, section, base)
+                cies[cie_pos] = cie
+            pc_begin, pos = read_pointer(data, pos, cie.fde_encoding, section, base)
+            pc_range, pos = read_pointer(data, pos, cie.fde_encoding & 0x0F, section, base)
+            if cie.augmentation.startswith("z"):
+                aug_length, pos = decode_uleb128(data, pos)
+                pos += aug_length
+            instructions = memoryview(data)[pos:record_end]
+            yield Fde(record - base, cie, pc_begin, pc_range, instructions)
+        pos = record_end
+
+
+def _cfa_operands(*kinds):
+    def read(data, pos):
+        operands = []
+        for kind in kinds:
+            if kind == "u":
+                value, pos = decode_uleb128(data, pos)
+            elif kind == "s":
+                value, pos = decode_sleb128(data, pos)
+            elif kind == "b":
+                length, pos = decode_uleb128(data, pos)
+                value, pos = data[pos : pos + length], pos + length
+            else:
+                value, pos = int.from_bytes(data[pos : pos + kind], "little"), pos + kind
+            operands.append(value)
+        return tuple(operands), pos
+
+    return read
+
+
+# DW_CFA_* with the primary opcode in the low 6 bits -> operand reader
+_CFA_OPERANDS = {
+    0x00: _cfa_operands(),
+    0x01: _cfa_operands(8),
+    0x02: _cfa_operands(1),
+    0x03: _cfa_operands(2),
+    0x04: _cfa_operands(4),
+    0x05: _cfa_operands("u", "u"),
+    0x06: _cfa_operands("u"),
+    0x07: _cfa_operands("u"),
+    0x08: _cfa_operands("u"),
+    0x09: _cfa_operands("u", "u"),
+    0x0A: _cfa_operands(),
+    0x0B: _cfa_operands(),
+    0x0C: _cfa_operands("u", "u"),
+    0x0D: _cfa_operands("u"),
+    0x0E: _cfa_operands("u"),
+    0x0F: _cfa_operands("b"),
+    0x10: _cfa_operands("u", "b"),
+    0x11: _cfa_operands("u", "s"),
+    0x12: _cfa_operands("u", "s"),
+    0x13: _cfa_operands("s"),
+    0x14: _cfa_operands("u", "u"),
+    0x15: _cfa_operands("u", "s"),
+    0x16: _cfa_operands("u", "b"),
+    0x2E: _cfa_operands("u"),
+    0x2F: _cfa_operands("u", "u"),
+}
+_CFA_PRIMARY = {0x40: _cfa_operands(), 0x80: _cfa_operands("u"), 0xC0: _cfa_operands()}
+
+
+def iter_cfa(instructions: memoryview):
+    """Yields (offset, opcode, operands) for a CFA instruction stream.
+
+    For advance_loc/offset/restore the low 6 bits stay in opcode. Block
+    operands are memoryviews into the stream.
+    """
+    pos = 0
+    while pos < len(instructions):
+        offset = pos
+        opcode = instructions[pos]
+        pos += 1
+        read = _CFA_PRIMARY.get(opcode & 0xC0) or _CFA_OPERANDS.get(opcode)
+        if read is None:
+            raise ValueError(f"unknown DW_CFA opcode {opcode:#x} at {offset:#x}")
+        operands, pos = read(instructions, pos)
+        yield offset, opcode, operands
+
+
+def _val_expressions(data, register):
+    eh_frame = read_sections(data).get(".eh_frame")
+    if eh_frame is None:
+        raise ValueError("no .eh_frame section")
+    found = []
+    for fde in iter_fdes(data, eh_frame):
+        for _, opcode, operands in iter_cfa(fde.instructions):
+            if opcode == DW_CFA_val_expression and operands[0] == register:
+                # keep no views into data, so the mapping can be closed
+                cie = fde.cie._replace(instructions=None)
+                found.append((fde._replace(cie=cie, instructions=None), bytes(operands[1])))
+    return found
+
+
+def find_val_expressions(path, register=RIP):
+    """Returns [(fde, expression bytes)] for every DW_CFA_val_expression on register in path."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return _val_expressions(data, register)
+
+
+def diff_expressions(expected: bytes, actual: bytes, context=3) -> list[str]:
+    """Returns a human-readable description of how actual differs from expected, or []."""
+    if expected == actual:
+        return []
+    first = next(
+        (i for i, (a, b) in enumerate(zip(expected, actual)) if a != b),
+        min(len(expected), len(actual)),
+    )
+    lines = [f"expressions differ at byte {first:#x} ({len(expected)} vs {len(actual)} bytes)"]
+    for label, data in (("expected", expected), ("actual", actual)):
+        try:
+            instructions = decode(data)
+        except (ValueError, KeyError, IndexError, struct.error):
+            lines.append(f"  {label}: {data[first:first + 16].hex()}")
+            continue
+        index = next(
+            (i for i, insn in enumerate(instructions) if insn.offset + insn.size > first),
+            len(instructions),
+        )
+        lines.append(f"  {label}:")
+        lines += [f"    {insn}" for insn in instructions[max(index - context, 0) : index + context]]
+    return lines
+
+
+def check_binary(path, expected: bytes) -> list[str]:
+    """Checks that path carries exactly one RIP val_expression equal to expected.
+
+    Returns a list of problems, empty when the binary matches.
+    """
+    found = find_val_expressions(path)
+    if len(found) != 1:
+        return [f"expected one DW_CFA_val_expression for RIP, found {len(found)}"]
+    return diff_expressions(expected, found[0][1])
+
+
+if __name__ == "__main__":
+    from gen_chall import dwarf_expression
+
+    parser = argparse.ArgumentParser(
+        description="Compare the val_expression in a built chall with the one gen_dwarf emits"
+    )
+    parser.add_argument("binary", nargs="?", default="chall")
+    parser.add_argument("-f", "--flag", default="flag.txt", help="flag the binary was built for")
+    parser.add_argument("-l", "--list", action="store_true", help="list every RIP val_expression")
+    args = parser.parse_args()
+
+    if args.list:
+        for fde, expression in find_val_expressions(args.binary):
+            end = fde.pc_begin + fde.pc_range
+            print(f"FDE {fde.offset:#x} pc {fde.pc_begin:#x}..{end:#x}: {len(expression)} bytes")
+    problems = check_binary(args.binary, dwarf_expression(Path(args.flag).read_bytes()))
+    if problems:
+        print("\n".join(problems), file=sys.stderr)
+        sys.exit(1)
+    print(f"{args.binary}: val_expression matches")
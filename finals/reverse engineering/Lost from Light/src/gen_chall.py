@@ -1,28 +1,60 @@
 #!/usr/bin/env python3
 
+import argparse
+import hashlib
+import os
+import struct
 from hashlib import md5
 from pathlib import Path
 from subprocess import check_output
 
 from mako.template import Template
 
+from eh_frame import check_binary
+from gen_dwarf import DELTA, NUM_ROUNDS, gen_dwarf
+from leb128 import encode_uleb128
+from tea import encrypt
+
+CACHE_DIR = Path(".build_cache")
+# everything render() runs besides flag.txt and the template; test_gen_chall.py checks that
+# every local module a render loads is listed
+GENERATOR_SOURCES = (
+    "gen_chall.py",
+    "gen_dwarf.py",
+    "dwarf_opt.py",
+    "dwarf_eval.py",
+    "eh_frame.py",
+    "leb128.py",
+    "stack_machine.py",
+    "tea.py",
+)
+# local files #included by the rendered source
+COMPILE_INPUTS = ("md5_simd.cpp",)
+
 
 def to_c_array(data):
     return ",".join(f"0x{b:02x}" for b in data)
 
 
-FLAG = Path("flag.txt").read_bytes()
-assert len(FLAG) == 56, "flag must be 56 characters long"
-flag_hash = md5(FLAG).digest()
+def cfi_operands(expression: bytes) -> str:
+    """Formats expression as the length-prefixed operand list of .cfi_escape."""
+    return ",".join(map(hex, [*encode_uleb128(len(expression)), *expression]))
+
+
+def dwarf_expression(flag: bytes) -> bytes:
+    """Returns the val_expression that checks flag, keyed on its md5."""
+    ciphertext = encrypt(flag, md5(flag).digest(), DELTA, NUM_ROUNDS)
+    return gen_dwarf(struct.unpack(f"<{len(ciphertext) // 4}L", ciphertext))
+
 
-template = Template(filename="chall.cpp.mako")
-dwarfs = check_output(["python3", "gen_dwarf.py"]).decode().strip()
+def render(flag: bytes) -> str:
+    template = Template(filename="chall.cpp.mako")
+    dwarfs = cfi_operands(dwarf_expression(flag))
+    return str(template.render(flag_hash=to_c_array(md5(flag).digest()), dwarfs=dwarfs))
 
-src = Path("chall.cpp")
-src.write_text(str(template.render(flag_hash=to_c_array(flag_hash), dwarfs=dwarfs)))
 
-check_output(
-    [
+def compiler_command(src: Path, output="chall"):
+    return [
         "g++",
         "-mavx2",
         "-masm=intel",
@@ -33,9 +65,86 @@ check_output(
         "-Wl,-z,relro,-z,now",
         # "-O3",
         "-o",
-        "chall",
+        output,
         src.as_posix(),
     ]
-)
 
-# src.unlink()
+
+def compile_chall(src: Path, output="chall"):
+    check_output(compiler_command(src, output))
+
+
+def digest(*parts: bytes) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+
+def cached(key: str, build) -> bytes:
+    """Returns the cache entry for key, calling build() to create it on a miss."""
+    path = CACHE_DIR / key
+    if path.exists():
+        return path.read_bytes()
+    data = build()
+    CACHE_DIR.mkdir(exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    return data
+
+
+def cached_render(flag: bytes) -> str:
+    key = digest(
+        flag,
+        Path("chall.cpp.mako").read_bytes(),
+        *(Path(name).read_bytes() for name in GENERATOR_SOURCES),
+    )
+    return cached(f"{key}.cpp", lambda: render(flag).encode()).decode()
+
+
+def cached_compile(src: Path, output="chall"):
+    command = compiler_command(src, output)
+    key = digest(
+        src.read_bytes(),
+        *(Path(name).read_bytes() for name in COMPILE_INPUTS),
+        "\0".join(command).encode(),
+        check_output([command[0], "--version"]),
+    )
+
+    def build():
+        compile_chall(src, output)
+        return Path(output).read_bytes()
+
+    binary = cached(f"{key}.bin", build)
+    if not Path(output).exists() or Path(output).read_bytes() != binary:
+        Path(output).write_bytes(binary)
+    os.chmod(output, os.stat(output).st_mode | 0o111)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render and compile the challenge")
+    parser.add_argument(
+        "--no-cache", action="store_true", help=f"ignore and don't update {CACHE_DIR}"
+    )
+    args = parser.parse_args()
+
+    FLAG = Path("flag.txt").read_bytes()
+    assert len(FLAG) == 56, "flag must be 56 characters long"
+
+    src = Path("chall.cpp")
+    if args.no_cache:
+        src.write_text(render(FLAG))
+        compile_chall(src)
+    else:
+        source = cached_render(FLAG)
+        if not src.exists() or src.read_text() != source:
+            src.write_text(source)
+        cached_compile(src)
+
+    problems = check_binary("chall", dwarf_expression(FLAG))
+    if problems:
+        raise SystemExit("\n".join(["chall does not carry the expected expression:", *problems]))
+
+    # src.unlink()
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 
-import io
-import math
 import struct
+from functools import lru_cache
+
+from leb128 import encode_uleb128, write_sleb128, write_uleb128
 
 DW_OP = {
     "addr": 3,
@@ -153,58 +154,148 @@ DW_OP = {
 }
 
 
-def encode_uleb128(value: int) -> bytes:
-    """Encodes an integer as an unsigned LEB128 byte sequence."""
-    if value < 0:
-        raise ValueError("ULEB128 cannot encode negative numbers.")
-    result = bytearray()
-    while True:
-        byte = value & 0x7F
-        value >>= 7
-        if value != 0:
-            byte |= 0x80
-        result.append(byte)
-        if value == 0:
-            break
-    return bytes(result)
+_U8 = struct.Struct("<B")
+_S8 = struct.Struct("<b")
+_U16 = struct.Struct("<H")
+_S16 = struct.Struct("<h")
+_U32 = struct.Struct("<I")
+_S32 = struct.Struct("<i")
+_U64 = struct.Struct("<Q")
+_S64 = struct.Struct("<q")
+
+_OPCODES = {name: bytes([code]) for name, code in DW_OP.items()}
+
+
+class Param:
+    """A placeholder operand inside a macro, filled in by emit()."""
+
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class Macro:
+    """A recorded sub-expression whose bytes are spliced in by emit()."""
 
+    __slots__ = ("code", "params")
 
-def encode_sleb128(value: int) -> bytes:
-    """Encodes an integer as a signed LEB128 byte sequence."""
-    result = bytearray()
-    while True:
-        byte = value & 0x7F
-        value >>= 7
-        more = True
-        if (value == 0 and (byte & 0x40) == 0) or (value == -1 and (byte & 0x40) != 0):
-            more = False
+    def __init__(self, code: bytes, params: tuple):
+        self.code = code
+        # (offset, packer, mask, name) for every Param operand
+        self.params = params
 
-        if more:
-            byte |= 0x80
 
-        result.append(byte)
+class Label:
+    """A branch target, created with label() and bound with place()."""
 
-        if not more:
-            break
-    return bytes(result)
+    __slots__ = ("offset",)
+
+    def __init__(self):
+        self.offset = None
 
 
 class DwarfExpressionBuilder:
     """Builds a DWARF expression incrementally."""
 
     def __init__(self, address_size=8):
-        self._buffer = io.BytesIO()
+        self._buffer = bytearray()
+        self._fixups: list[tuple[int, Label]] = []
+        self._params: list[tuple[int, struct.Struct, int | None, str]] = []
         self.address_size = address_size
 
     def get_bytes(self) -> bytes:
-        """Returns the accumulated bytecode for the expression."""
-        return self._buffer.getvalue()
+        """Returns the accumulated bytecode for the expression, with branch offsets resolved."""
+        result = bytearray(self._buffer)
+        for pos, label in self._fixups:
+            if label.offset is None:
+                raise ValueError("branch to a label that was never placed")
+            offset = label.offset - (pos + 2)
+            if not -0x8000 <= offset <= 0x7FFF:
+                raise ValueError(f"branch offset {offset} does not fit in 16 bits")
+            _S16.pack_into(result, pos, offset)
+        return bytes(result)
+
+    def label(self) -> Label:
+        """Creates a label that bra()/skip() can target before or after it is placed."""
+        return Label()
+
+    def place(self, label: Label):
+        """Binds label to the current position."""
+        if label.offset is not None:
+            raise ValueError("label is already placed")
+        label.offset = len(self._buffer)
+        return self
+
+    def loop(self, counter: range, body):
+        """Emits a counted loop running body once per value of counter.
+
+        The counter is pushed before the first iteration and must be the top
+        of the stack whenever body starts and returns (so pick indices inside
+        body are one higher); it is dropped when the loop ends.
+        """
+        if counter.step <= 0:
+            raise ValueError("loop counter must count upwards")
+        if not counter:
+            return self
+        top = self.label()
+        self.lit(counter.start).place(top)
+        body(self)
+        return self.plus_uconst(counter.step).dup().lit(counter.stop).lt().bra(top).drop()
+
+    def do_while(self, body, condition):
+        """Emits body, then condition, and branches back while condition leaves non-zero."""
+        top = self.label()
+        self.place(top)
+        body(self)
+        condition(self)
+        return self.bra(top)
+
+    def macro(self, body) -> Macro:
+        """Records body into a reusable macro.
+
+        body is called with a fresh builder; fixed-width operands (addr, constNu,
+        constNs, pick, deref_size) may be given as Param placeholders and are
+        filled in on every emit(). Labels used inside body must be placed there.
+        """
+        recorder = DwarfExpressionBuilder(self.address_size)
+        body(recorder)
+        return Macro(recorder.get_bytes(), tuple(recorder._params))
+
+    def emit(self, macro: Macro, **params):
+        """Splices the bytes of macro into the expression, patching its params."""
+        names = {name for _, _, _, name in macro.params}
+        if names != params.keys():
+            raise ValueError(f"macro expects params {sorted(names)}, got {sorted(params)}")
+        start = len(self._buffer)
+        self._buffer += macro.code
+        for offset, packer, mask, name in macro.params:
+            self._patch(start + offset, packer, mask, params[name])
+        return self
+
+    def op(self, op_name: str, operand: bytes = b""):
+        """Writes op_name followed by its already-encoded operand bytes."""
+        self._write_op(op_name)
+        self._buffer += operand
+        return self
 
     def _write_op(self, op_name: str):
         """Writes a simple opcode with no operands."""
-        if op_name not in DW_OP:
+        if op_name not in _OPCODES:
             raise ValueError(f"Unknown DWARF operation: {op_name}")
-        self._buffer.write(struct.pack("B", DW_OP[op_name]))
+        self._buffer += _OPCODES[op_name]
+
+    def _write_fixed(self, packer: struct.Struct, value, mask=None):
+        """Writes a fixed-width operand, which may be a Param placeholder."""
+        start = len(self._buffer)
+        self._buffer += bytes(packer.size)
+        self._patch(start, packer, mask, value)
+
+    def _patch(self, pos, packer, mask, value):
+        if isinstance(value, Param):
+            self._params.append((pos, packer, mask, value.name))
+        else:
+            packer.pack_into(self._buffer, pos, value if mask is None else value & mask)
 
     def lit(self, value: int):
         if 0 <= value <= 31:
@@ -215,80 +306,79 @@ class DwarfExpressionBuilder:
 
     def addr(self, address: int):
         self._write_op("addr")
-        pack_format = "<I" if self.address_size == 4 else "<Q"
-        self._buffer.write(struct.pack(pack_format, address))
+        self._write_fixed(_U32 if self.address_size == 4 else _U64, address)
         return self
 
     def const1u(self, value: int):
         self._write_op("const1u")
-        self._buffer.write(struct.pack("<B", value & 0xFF))
+        self._write_fixed(_U8, value, 0xFF)
         return self
 
     def const1s(self, value: int):
         self._write_op("const1s")
-        self._buffer.write(struct.pack("<b", value))
+        self._write_fixed(_S8, value)
         return self
 
     def const2u(self, value: int):
         self._write_op("const2u")
-        self._buffer.write(struct.pack("<H", value & 0xFFFF))
+        self._write_fixed(_U16, value, 0xFFFF)
         return self
 
     def const2s(self, value: int):
         self._write_op("const2s")
-        self._buffer.write(struct.pack("<h", value))
+        self._write_fixed(_S16, value)
         return self
 
     def const4u(self, value: int):
         self._write_op("const4u")
-        self._buffer.write(struct.pack("<I", value & 0xFFFFFFFF))
+        self._write_fixed(_U32, value, 0xFFFFFFFF)
         return self
 
     def const4s(self, value: int):
         self._write_op("const4s")
-        self._buffer.write(struct.pack("<i", value))
+        self._write_fixed(_S32, value)
         return self
 
     def const8u(self, value: int):
         self._write_op("const8u")
-        self._buffer.write(struct.pack("<Q", value & 0xFFFFFFFFFFFFFFFF))
+        self._write_fixed(_U64, value, 0xFFFFFFFFFFFFFFFF)
         return self
 
     def const8s(self, value: int):
         self._write_op("const8s")
-        self._buffer.write(struct.pack("<q", value))
+        self._write_fixed(_S64, value)
         return self
 
     def constu(self, value: int):
         self._write_op("constu")
-        self._buffer.write(encode_uleb128(value))
+        write_uleb128(self._buffer, value)
         return self
 
     def consts(self, value: int):
         self._write_op("consts")
-        self._buffer.write(encode_sleb128(value))
+        write_sleb128(self._buffer, value)
         return self
 
     def fbreg(self, offset: int):
         self._write_op("fbreg")
-        self._buffer.write(encode_sleb128(offset))
+        write_sleb128(self._buffer, offset)
         return self
 
     def breg(self, reg_num: int, offset: int):
         if 0 <= reg_num <= 31:
-            self._buffer.write(struct.pack("B", DW_OP["breg0"] + reg_num))
+            self._buffer.append(DW_OP["breg0"] + reg_num)
         else:
             self._write_op("bregx")
-            self._buffer.write(encode_uleb128(reg_num))
-        self._buffer.write(encode_sleb128(offset))
+            write_uleb128(self._buffer, reg_num)
+        write_sleb128(self._buffer, offset)
         return self
 
     def reg(self, reg_num: int):
         if 0 <= reg_num <= 31:
-            self._buffer.write(struct.pack("B", DW_OP["reg0"] + reg_num))
+            self._buffer.append(DW_OP["reg0"] + reg_num)
         else:
             self._write_op("regx")
-            self._buffer.write(encode_uleb128(reg_num))
+            write_uleb128(self._buffer, reg_num)
         return self
 
     def deref(self):
@@ -413,177 +503,211 @@ class DwarfExpressionBuilder:
 
     def plus_uconst(self, value: int):
         self._write_op("plus_uconst")
-        self._buffer.write(encode_uleb128(value))
+        write_uleb128(self._buffer, value)
         return self
 
-    def skip(self, offset: int):
+    def skip(self, target: int | Label):
         self._write_op("skip")
-        self._buffer.write(struct.pack("<h", offset))
+        self._write_branch_target(target)
         return self
 
-    def bra(self, offset: int):
+    def bra(self, target: int | Label):
         self._write_op("bra")
-        self._buffer.write(struct.pack("<h", offset))
+        self._write_branch_target(target)
         return self
 
+    def _write_branch_target(self, target: int | Label):
+        if isinstance(target, Label):
+            self._fixups.append((len(self._buffer), target))
+            target = 0
+        self._buffer += _S16.pack(target)
+
     def piece(self, size: int):
         self._write_op("piece")
-        self._buffer.write(encode_uleb128(size))
+        write_uleb128(self._buffer, size)
         return self
 
     def deref_size(self, size: int):
         self._write_op("deref_size")
-        self._buffer.write(struct.pack("<B", size))
+        self._write_fixed(_U8, size)
         return self
 
     def pick(self, index: int):
         self._write_op("pick")
-        self._buffer.write(struct.pack("<B", index))
+        self._write_fixed(_U8, index)
         return self
 
 
-if __name__ == "__main__":
-    KEY_ADDR = 0x405010
-    PLAINTEXT_ADDR = 0x405280
-    PLAINTEXT_SIZE = 56
-    BLOCK_SIZE = 8
-    NUM_BLOCKS = math.ceil(PLAINTEXT_SIZE / BLOCK_SIZE)
-    NUM_ROUNDS = 8
-    DELTA = 0x13371337
-
-    IF_CORRECT = 0x40132C
-    IF_WRONG = 0x4013B0
-
-    builder = DwarfExpressionBuilder()
-
-    for i in range(NUM_BLOCKS):
-        block_addr = PLAINTEXT_ADDR + i * BLOCK_SIZE
+def tea_round(builder: DwarfExpressionBuilder, delta: int):
+    # [sum, v1, v0, k3, k2, k1, k0, ...] -> [new_sum, new_v1, new_v0, k3, k2, k1, k0, ...]
+    (
+        builder.const4u(delta)
+        .plus()
+        .const4u(0xFFFFFFFF)
+        .band()
+        .rot()
+        .over()
+        .over()
+        .lit(4)
+        .shl()
+        .pick(8)
+        .plus()
+        .pick(2)
+        .pick(5)
+        .plus()
+        .pick(3)
+        .lit(5)
+        .shr()
+        .pick(9)
+        .plus()
+        .xor()
+        .xor()
+        .plus()
+        .const4u(0xFFFFFFFF)
+        .band()
+        .rot()
+        .rot()
+        .drop()
+        .swap()
+        .over()
+        .lit(4)
+        .shl()
+        .pick(5)
+        .plus()
+        .pick(2)
+        .pick(4)
+        .plus()
+        .pick(3)
+        .lit(5)
+        .shr()
+        .pick(6)
+        .plus()
+        .xor()
+        .xor()
+        .plus()
+        .const4u(0xFFFFFFFF)
+        .band()
+        .rot()
+        .rot()
+    )
+    return builder
+
+
+@lru_cache(maxsize=None)
+def tea_round_macro(address_size=8) -> Macro:
+    """tea_round recorded once as a macro with a "delta" param."""
+    return DwarfExpressionBuilder(address_size).macro(lambda b: tea_round(b, Param("delta")))
+
+
+def tea_rounds(builder: DwarfExpressionBuilder, delta: int, rounds: int):
+    """Emits the TEA rounds as a loop that ends once sum reaches rounds * delta."""
+    macro = tea_round_macro(builder.address_size)
+    final_sum = (delta * rounds) & 0xFFFFFFFF
+    if len({(delta * n) & 0xFFFFFFFF for n in range(1, rounds + 1)}) < rounds:
+        # sum repeats before the last round, so it cannot end the loop
+        for _ in range(rounds):
+            builder.emit(macro, delta=delta)
+    elif rounds > 0:
+        builder.do_while(
+            lambda b: b.emit(macro, delta=delta),
+            lambda b: b.dup().const4u(final_sum).ne(),
+        )
+    return builder
+
+
+KEY_ADDR = 0x405010
+PLAINTEXT_ADDR = 0x405280
+IF_CORRECT = 0x40132C
+IF_WRONG = 0x4013B0
+DELTA = 0x13371337
+NUM_ROUNDS = 8
+BLOCK_SIZE = 8
+
+
+@lru_cache(maxsize=None)
+def gen_dwarf(
+    ciphertext: tuple[int, ...],
+    key_addr=KEY_ADDR,
+    plaintext_addr=PLAINTEXT_ADDR,
+    if_correct=IF_CORRECT,
+    if_wrong=IF_WRONG,
+    delta=DELTA,
+    rounds=NUM_ROUNDS,
+    optimized=True,
+) -> bytes:
+    """Returns the expression that checks the plaintext at plaintext_addr.
+
+    The plaintext is TEA-encrypted in place on the stack with the 16-byte key
+    at key_addr and compared against ciphertext, given as the little-endian
+    32-bit words of the expected ciphertext. The expression evaluates to
+    if_correct on a match and to if_wrong otherwise.
+    """
+    if len(ciphertext) % 2 != 0:
+        raise ValueError("ciphertext must be a whole number of (v0, v1) blocks")
+    num_blocks = len(ciphertext) // 2
+
+    def encrypt_block(builder: DwarfExpressionBuilder):
+        # [offset, ...]
         (
-            builder.addr(KEY_ADDR)
+            builder.addr(key_addr)
             .deref_size(4)
-            .addr(KEY_ADDR + 4)
+            .addr(key_addr + 4)
             .deref_size(4)
-            .addr(KEY_ADDR + 8)
+            .addr(key_addr + 8)
             .deref_size(4)
-            .addr(KEY_ADDR + 12)
+            .addr(key_addr + 12)
             .deref_size(4)
-            .addr(block_addr)
+            .pick(4)
+            .plus_uconst(plaintext_addr)
             .deref_size(4)
-            .addr(block_addr + 4)
+            .pick(5)
+            .plus_uconst(plaintext_addr + 4)
             .deref_size(4)
             .lit(0)
         )
-        for _ in range(NUM_ROUNDS):
-            (
-                builder.const4u(DELTA)
-                .plus()
-                .const4u(0xFFFFFFFF)
-                .band()
-                .rot()
-                .over()
-                .over()
-                .lit(4)
-                .shl()
-                .pick(8)
-                .plus()
-                .pick(2)
-                .pick(5)
-                .plus()
-                .pick(3)
-                .lit(5)
-                .shr()
-                .pick(9)
-                .plus()
-                .xor()
-                .xor()
-                .plus()
-                .const4u(0xFFFFFFFF)
-                .band()
-                .rot()
-                .rot()
-                .drop()
-                .swap()
-                .over()
-                .lit(4)
-                .shl()
-                .pick(5)
-                .plus()
-                .pick(2)
-                .pick(4)
-                .plus()
-                .pick(3)
-                .lit(5)
-                .shr()
-                .pick(6)
-                .plus()
-                .xor()
-                .xor()
-                .plus()
-                .const4u(0xFFFFFFFF)
-                .band()
-                .rot()
-                .rot()
-            )
+        tea_rounds(builder, delta, rounds)
+        # [sum, v1, v0, k3, k2, k1, k0, offset, ...] -> [offset, v1, v0, ...]
         builder.drop().rot().rot().drop().rot().rot().drop().rot().rot().drop().rot().rot().drop()
-    (
-        builder.const4u(0x69D6E2E0)
-        .eq()
-        .swap()
-        .const4u(0xD44D2E26)
-        .eq()
-        .band()
-        .swap()
-        .const4u(0x1B0E2315)
-        .eq()
-        .band()
-        .swap()
-        .const4u(0x72DA7209)
-        .eq()
-        .band()
-        .swap()
-        .const4u(0xD5E2C222)
-        .eq()
-        .band()
-        .swap()
-        .const4u(0x5791AC4C)
-        .eq()
-        .band()
-        .swap()
-        .const4u(0xCF35086B)
-        .eq()
-        .band()
-        .swap()
-        .const4u(0xABFF26E3)
-        .eq()
-        .band()
-        .swap()
-        .const4u(0x1CB2B476)
-        .eq()
-        .band()
-        .swap()
-        .const4u(0xFF56BFE9)
-        .eq()
-        .band()
-        .swap()
-        .const4u(0x2F89FA84)
-        .eq()
-        .band()
-        .swap()
-        .const4u(0x731262C)
-        .eq()
-        .band()
-        .swap()
-        .const4u(0xDF72C75)
-        .eq()
-        .band()
-        .swap()
-        .const4u(0xBE6121B7)
-        .eq()
-        .band()
-        .bra(12)
-        .addr(IF_WRONG)
-        .skip(9)
-        .addr(IF_CORRECT)
-    )
+        builder.rot().rot()
+
+    builder = DwarfExpressionBuilder()
+    builder.loop(range(0, num_blocks * BLOCK_SIZE, BLOCK_SIZE), encrypt_block)
+
+    # the last block's v1 is on top, so compare the words back to front
+    words = ciphertext[::-1]
+    builder.const4u(words[0]).eq()
+    for word in words[1:]:
+        builder.swap().const4u(word).eq().band()
+
+    correct = builder.label()
+    end = builder.label()
+    builder.bra(correct).addr(if_wrong).skip(end).place(correct).addr(if_correct).place(end)
     result = builder.get_bytes()
+    if optimized:
+        from dwarf_opt import check_equivalent, optimize, random_images
+
+        original, result = result, optimize(result)
+        stores = [(key_addr, bytes(16)), (plaintext_addr, bytes(num_blocks * BLOCK_SIZE))]
+        check_equivalent(original, result, random_images(stores, 4))
+    return result
+
+
+if __name__ == "__main__":
+    CIPHERTEXT = (
+        0xBE6121B7,
+        0xDF72C75,
+        0x731262C,
+        0x2F89FA84,
+        0xFF56BFE9,
+        0x1CB2B476,
+        0xABFF26E3,
+        0xCF35086B,
+        0x5791AC4C,
+        0xD5E2C222,
+        0x72DA7209,
+        0x1B0E2315,
+        0xD44D2E26,
+        0x69D6E2E0,
+    )
+    result = gen_dwarf(CIPHERTEXT)
     print(",".join(map(hex, [*encode_uleb128(len(result)), *result])))
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+from array import array
+
+# one- and two-byte encodings are looked up instead of computed
+_ULEB_SMALL = [bytes([v]) if v < 0x80 else bytes([v & 0x7F | 0x80, v >> 7]) for v in range(0x4000)]
+_SLEB_SMALL = {
+    v: bytes([v & 0x7F]) if -0x40 <= v < 0x40 else bytes([v & 0x7F | 0x80, (v >> 7) & 0x7F])
+    for v in range(-0x2000, 0x2000)
+}
+
+
+def _encode_uleb128_slow(value: int) -> bytes:
+    result = bytearray()
+    while value >= 0x80:
+        result.append(value & 0x7F | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def _encode_sleb128_slow(value: int) -> bytes:
+    result = bytearray()
+    while not -0x40 <= value < 0x40:
+        result.append(value & 0x7F | 0x80)
+        value >>= 7
+    result.append(value & 0x7F)
+    return bytes(result)
+
+
+def encode_uleb128(value: int) -> bytes:
+    """Encodes an integer as an unsigned LEB128 byte sequence."""
+    if value < 0:
+        raise ValueError("ULEB128 cannot encode negative numbers.")
+    if value < 0x4000:
+        return _ULEB_SMALL[value]
+    return _encode_uleb128_slow(value)
+
+
+def encode_sleb128(value: int) -> bytes:
+    """Encodes an integer as a signed LEB128 byte sequence."""
+    encoded = _SLEB_SMALL.get(value)
+    return encoded if encoded is not None else _encode_sleb128_slow(value)
+
+
+def _write(buffer, encoded: bytes, offset):
+    if offset is None:
+        buffer += encoded
+        return len(buffer)
+    end = offset + len(encoded)
+    buffer[offset:end] = encoded
+    return end
+
+
+def write_uleb128(buffer, value: int, offset=None) -> int:
+    """Encodes value into buffer and returns the offset just past it.
+
+    With offset=None the bytes are appended to buffer (a bytearray); otherwise
+    they overwrite buffer[offset:], which may be any writable buffer such as
+    a memoryview.
+    """
+    return _write(buffer, encode_uleb128(value), offset)
+
+
+def write_sleb128(buffer, value: int, offset=None) -> int:
+    """Signed counterpart of write_uleb128."""
+    return _write(buffer, encode_sleb128(value), offset)
+
+
+def decode_uleb128(data: bytes, offset=0) -> tuple[int, int]:
+    """Decodes an unsigned LEB128 value, returning (value, next offset)."""
+    byte = data[offset]
+    if byte < 0x80:
+        return byte, offset + 1
+    result = byte & 0x7F
+    shift = 7
+    while True:
+        offset += 1
+        byte = data[offset]
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, offset + 1
+        shift += 7
+
+
+def decode_sleb128(data: bytes, offset=0) -> tuple[int, int]:
+    """Decodes a signed LEB128 value, returning (value, next offset)."""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            if byte & 0x40:
+                result -= 1 << shift
+            return result, offset
+
+
+def decode_uleb128_array(data, offset=0, end=None, typecode="Q") -> array:
+    """Decodes the back-to-back ULEB128 values in data[offset:end] into an array.
+
+    Raises ValueError if the last value is truncated.
+    """
+    values = array(typecode)
+    append = values.append
+    value = shift = 0
+    for byte in memoryview(data)[offset:end].cast("B"):
+        if byte < 0x80:
+            append(value | byte << shift)
+            value = shift = 0
+        else:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+    if shift:
+        raise ValueError("truncated ULEB128 value")
+    return values
+
+
+def decode_sleb128_array(data, offset=0, end=None, typecode="q") -> array:
+    """Decodes the back-to-back SLEB128 values in data[offset:end] into an array."""
+    values = array(typecode)
+    append = values.append
+    value = shift = 0
+    for byte in memoryview(data)[offset:end].cast("B"):
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            append(value - (1 << shift) if byte & 0x40 else value)
+            value = shift = 0
+    if shift:
+        raise ValueError("truncated SLEB128 value")
+    return values
+
+
+if __name__ == "__main__":
+    import random
+    import timeit
+
+    random.seed(0)
+    small = [random.randrange(0x4000) for _ in range(100_000)]
+    large = [random.randrange(1 << 63) for _ in range(100_000)]
+    signed = [random.randrange(-0x2000, 0x2000) for _ in range(100_000)]
+    packed = b"".join(map(encode_uleb128, small))
+    packed_signed = b"".join(map(encode_sleb128, signed))
+
+    def decode_each(data, decode):
+        pos = 0
+        values = []
+        while pos < len(data):
+            value, pos = decode(data, pos)
+            values.append(value)
+        return values
+
+    def write_all(values):
+        buffer = bytearray()
+        for value in values:
+            write_uleb128(buffer, value)
+        return buffer
+
+    assert list(decode_uleb128_array(packed)) == small == decode_each(packed, decode_uleb128)
+    assert list(decode_sleb128_array(packed_signed)) == signed
+    assert bytes(write_all(small)) == packed
+
+    benchmarks = [
+        ("uleb encode < 2^14", lambda: [encode_uleb128(v) for v in small]),
+        ("uleb encode < 2^63", lambda: [encode_uleb128(v) for v in large]),
+        ("sleb encode |v| < 2^13", lambda: [encode_sleb128(v) for v in signed]),
+        ("uleb write into bytearray", lambda: write_all(small)),
+        ("uleb decode one at a time", lambda: decode_each(packed, decode_uleb128)),
+        ("uleb decode into array", lambda: decode_uleb128_array(packed)),
+        ("sleb decode one at a time", lambda: decode_each(packed_signed, decode_sleb128)),
+        ("sleb decode into array", lambda: decode_sleb128_array(packed_signed)),
+    ]
+    for name, fn in benchmarks:
+        best = min(timeit.repeat(fn, number=1, repeat=5))
+        print(f"{name:36} {len(small) / best / 1e6:6.2f} M values/s")
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from stack_machine import (
+    _STACK_EFFECTS,
+    FixedWidthStackMachine,
+    Program,
+    StackMachine,
+    tea_encrypt_block_program,
+)
+
+
+class Profiler:
+    """Counts, times and measures the ops run by one or more StackMachines.
+
+    attach() shadows the op methods of a single machine instance with
+    instrumented wrappers and detach() deletes them again. Nothing is added
+    to the classes, so machines that are not attached run exactly the code
+    they ran before, without a per-op check.
+
+    While attached, execute() replays the program's ops one by one through the
+    wrappers instead of running its fused handlers, so the profile shows the
+    ops as they were recorded. execute(program, jit=True) runs the compiled
+    function and records it as a single "execute(jit)" op.
+    """
+
+    def __init__(self, clock=time.perf_counter_ns):
+        self.clock = clock
+        self.counts = Counter()
+        self.times = Counter()
+        self.pairs = Counter()
+        self.folded = Counter()
+        self.folded_counts = Counter()
+        self.max_depth = 0
+        # total size of every load, so bytes read twice count twice
+        self.loaded_bytes = 0
+        self._frames = []
+        self._previous = None
+        self._running = False
+        self._attached = {}
+
+    def attach(self, machine: StackMachine):
+        if id(machine) in self._attached:
+            return machine
+        depth = (
+            (lambda: machine._sp)
+            if isinstance(machine, FixedWidthStackMachine)
+            else (lambda: len(machine._stack))
+        )
+        names = [*_STACK_EFFECTS, "execute"]
+        for name in _STACK_EFFECTS:
+            setattr(machine, name, self._wrap(machine, name, depth))
+        machine.execute = self._wrap_execute(machine, depth)
+        self._attached[id(machine)] = (machine, names)
+        return machine
+
+    def detach(self, machine: StackMachine = None):
+        """Removes the wrappers from machine, or from every attached machine."""
+        machines = [machine] if machine is not None else [m for m, _ in self._attached.values()]
+        for m in machines:
+            _, names = self._attached.pop(id(m))
+            for name in names:
+                delattr(m, name)
+
+    @contextmanager
+    def section(self, name):
+        """Nests every op run inside the block under a `name` frame in the folded profile."""
+        self._frames.append(name)
+        try:
+            yield
+        finally:
+            self._frames.pop()
+
+    def _wrap(self, machine, name, depth, method=None):
+        if method is None:
+            method = getattr(type(machine), name).__get__(machine)
+        clock = self.clock
+        counts, times, pairs = self.counts, self.times, self.pairs
+        folded, folded_counts = self.folded, self.folded_counts
+        frames = self._frames
+        address_size = machine._address_size
+
+        def op(*args):
+            if self._running:
+                # an op implemented in terms of another one counts once
+                method(*args)
+                return machine
+            self._running = True
+            start = clock()
+            try:
+                method(*args)
+            finally:
+                self._running = False
+            elapsed = clock() - start
+            counts[name] += 1
+            times[name] += elapsed
+            stack = (*frames, name)
+            folded[stack] += elapsed
+            folded_counts[stack] += 1
+            pairs[(self._previous, name)] += 1
+            self._previous = name
+            d = depth()
+            if d > self.max_depth:
+                self.max_depth = d
+            if name == "deref_size":
+                self.loaded_bytes += args[0]
+            elif name == "deref":
+                self.loaded_bytes += address_size
+            return machine
+
+        return op
+
+    def _wrap_execute(self, machine, depth):
+        jitted = self._wrap(
+            machine,
+            "execute(jit)",
+            depth,
+            lambda program: type(machine).execute(machine, program, jit=True),
+        )
+
+        def execute(program: Program, jit=False):
+            if depth() < program.min_depth:
+                raise RuntimeError(f"stack must have at least {program.min_depth} elements")
+            if jit:
+                return jitted(program)
+            with self.section("execute"):
+                for name, *args in program.ops:
+                    getattr(machine, name)(*args)
+            return machine
+
+        return execute
+
+    def report(self) -> str:
+        total = sum(self.times.values()) or 1
+        lines = [f"{'op':12} {'count':>10} {'total ms':>10} {'ns/op':>8} {'share':>7}"]
+        for name, elapsed in self.times.most_common():
+            count = self.counts[name]
+            lines.append(
+                f"{name:12} {count:10} {elapsed / 1e6:10.3f} {elapsed / count:8.0f} "
+                f"{elapsed / total:7.1%}"
+            )
+        lines.append(f"max stack depth: {self.max_depth}")
+        lines.append(f"bytes loaded: {self.loaded_bytes}")
+        lines.append("most frequent adjacent ops:")
+        for (a, b), count in self.pairs.most_common(8):
+            if a is not None:
+                lines.append(f"  {a} {b}: {count}")
+        return "\n".join(lines)
+
+    def export_folded(self, file, weight="time"):
+        """Writes the profile in the folded-stack format read by flamegraph.pl and speedscope.
+
+        Each line is `frame;frame;op value`, where value is nanoseconds
+        (weight="time") or executions (weight="count").
+        """
+        samples = self.folded if weight == "time" else self.folded_counts
+        for stack, value in sorted(samples.items()):
+            if value:
+                file.write(f"{';'.join(stack)} {value}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile StackMachine running TEA")
+    parser.add_argument("-o", "--folded", help="write a folded-stack profile to this file")
+    parser.add_argument("-w", "--weight", choices=("time", "count"), default="time")
+    args = parser.parse_args()
+
+    plaintext = b"ARKAV{this_chall_is_as_treacherous_as_lost_from_light!!}"
+    profiler = Profiler()
+    machine = profiler.attach(StackMachine())
+    machine.store(0, bytes.fromhex("dc9e3ac003ca259f20f6a5ad6ecfbce8"))
+    machine.store(0x10, plaintext)
+    for i in range(len(plaintext) // 8):
+        program = tea_encrypt_block_program(0x10 + i * 8, 0, delta=0x13371337, rounds=8)
+        with profiler.section(f"block{i}"):
+            machine.execute(program)
+    profiler.detach()
+    print(profiler.report())
+    if args.folded:
+        with open(args.folded, "w") as f:
+            profiler.export_folded(f, args.weight)
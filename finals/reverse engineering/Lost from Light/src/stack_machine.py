@@ -1,14 +1,97 @@
 #!/usr/bin/env python3
 
+import copy
 import math
+import operator
 import struct
+from array import array
+from functools import lru_cache
+
+_UNPACKERS = {
+    size: struct.Struct(fmt).unpack_from
+    for size, fmt in ((1, "<B"), (2, "<H"), (4, "<I"), (8, "<Q"))
+}
+
+
+def _out_of_bound(mem_size):
+    max = f"{mem_size:x}"
+    min = "0" * len(max)
+    return ValueError(f"address out of bound (0x{min}-0x{max})")
+
+
+class PagedMemory:
+    """Sparse memory made of lazily allocated pages.
+
+    Pages are only allocated when they are stored to and unmapped pages read
+    as zeros. fork() shares every page copy-on-write, so one loaded image can
+    back any number of machines.
+    """
+
+    PAGE_SHIFT = 12
+    PAGE_SIZE = 1 << PAGE_SHIFT
+    PAGE_MASK = PAGE_SIZE - 1
+
+    _ZERO_PAGE = bytes(PAGE_SIZE)
+
+    def __init__(self, size=0x100000):
+        self._size = size
+        self._pages: dict[int, bytearray] = {}
+        self._owned: set[int] = set()
+
+    def __len__(self):
+        return self._size
+
+    def store(self, address: int, value: bytes | bytearray):
+        if address < 0 or address + len(value) > self._size:
+            raise _out_of_bound(self._size)
+        view = memoryview(value).cast("B")
+        offset = 0
+        while offset < len(view):
+            page_offset = (address + offset) & self.PAGE_MASK
+            n = min(self.PAGE_SIZE - page_offset, len(view) - offset)
+            page = self._writable_page((address + offset) >> self.PAGE_SHIFT)
+            page[page_offset : page_offset + n] = view[offset : offset + n]
+            offset += n
+
+    def load(self, address: int, size: int) -> int:
+        """Reads a little-endian unsigned integer of 1, 2, 4 or 8 bytes."""
+        page_offset = address & self.PAGE_MASK
+        if page_offset + size <= self.PAGE_SIZE:
+            page = self._pages.get(address >> self.PAGE_SHIFT, self._ZERO_PAGE)
+            return _UNPACKERS[size](page, page_offset)[0]
+        return int.from_bytes(self.read(address, size), "little")
+
+    def read(self, address: int, size: int) -> bytes:
+        chunks = []
+        end = address + size
+        while address < end:
+            page_offset = address & self.PAGE_MASK
+            n = min(self.PAGE_SIZE - page_offset, end - address)
+            page = self._pages.get(address >> self.PAGE_SHIFT, self._ZERO_PAGE)
+            chunks.append(memoryview(page)[page_offset : page_offset + n])
+            address += n
+        return b"".join(chunks)
+
+    def fork(self) -> "PagedMemory":
+        """Returns a copy-on-write clone; neither side sees the other's later stores."""
+        child = PagedMemory(self._size)
+        child._pages = dict(self._pages)
+        self._owned.clear()
+        return child
+
+    def _writable_page(self, page_no):
+        if page_no not in self._owned:
+            page = self._pages.get(page_no)
+            self._pages[page_no] = bytearray(self.PAGE_SIZE) if page is None else bytearray(page)
+            self._owned.add(page_no)
+        return self._pages[page_no]
 
 
 class StackMachine:
     def __init__(self, address_size=8, mem_size=0x100000):
         self._address_size = address_size
         self._stack: list[int] = []
-        self._mem = bytearray(mem_size)
+        self._mem = PagedMemory(mem_size)
 
     def const(self, val):
         self._stack.append(val)
@@ -150,37 +233,47 @@ class StackMachine:
         return self
 
     def deref(self):
-        addr = self._stack.pop()
-        if 0 <= addr < len(self._mem):
-            vb = self._mem[addr : addr + self._address_size]
-            self._stack.append(struct.unpack("<Q", vb)[0])
-            return self
-        else:
-            max = f"{len(self._mem):x}"
-            min = "0" * len(max)
-            raise ValueError(f"address out of bound (0x{min}-0x{max})")
+        self.__assert_elements(1)
+        self._stack.append(self._load(self._stack.pop(), self._address_size))
+        return self
 
     def deref_size(self, size):
         if size not in (1, 2, 4, 8):
             raise ValueError("size must be one of (1, 2, 4, 8)")
-        addr = self._stack.pop()
-        if not (0 <= addr < len(self._mem)):
-            max = f"{len(self._mem):x}"
-            min = "0" * len(max)
-            raise ValueError(f"address out of bound (0x{min}-0x{max})")
-        vb = self._mem[addr : addr + size]
-        if size == 1:
-            self._stack.append(struct.unpack("<B", vb)[0])
-        elif size == 2:
-            self._stack.append(struct.unpack("<H", vb)[0])
-        elif size == 4:
-            self._stack.append(struct.unpack("<I", vb)[0])
-        elif size == 8:
-            self._stack.append(struct.unpack("<Q", vb)[0])
+        self.__assert_elements(1)
+        self._stack.append(self._load(self._stack.pop(), size))
         return self
 
     def store(self, address: int, value: bytes | bytearray):
-        self._mem[address : address + len(value)] = value
+        self._mem.store(address, value)
+
+    def fork(self):
+        """Returns a machine with a copy of the stack and copy-on-write memory."""
+        child = copy.copy(self)
+        child._stack = copy.copy(self._stack)
+        child._mem = self._mem.fork()
+        return child
+
+    def execute(self, program: "Program", jit=False):
+        """Runs a recorded program against the current stack and memory.
+
+        With jit=True the program is compiled once by jit_compile into a
+        straight-line function and that function is run instead.
+        """
+        stack = self._stack
+        if len(stack) < program.min_depth:
+            raise RuntimeError(f"stack must have at least {program.min_depth} elements")
+        if jit:
+            jit_compile(program)(stack, self._load, self._address_size)
+            return self
+        for handler, arg in program.code:
+            handler(stack, self, arg)
+        return self
+
+    def _load(self, addr, size):
+        if not (0 <= addr < len(self._mem)):
+            raise _out_of_bound(len(self._mem))
+        return self._mem.load(addr, size)
 
     def __assert_elements(self, n):
         if len(self._stack) < n:
@@ -191,6 +284,750 @@ class StackMachine:
         return self
 
 
+# op name -> (minimum stack depth, net stack change); pick is handled separately
+_STACK_EFFECTS = {
+    "const": (0, 1),
+    "plus": (2, -1),
+    "minus": (2, -1),
+    "div": (2, -1),
+    "mod": (2, -1),
+    "mul": (2, -1),
+    "shl": (2, -1),
+    "shr": (2, -1),
+    "xor": (2, -1),
+    "neg": (1, 0),
+    "abs": (1, 0),
+    "bnot": (1, 0),
+    "band": (2, -1),
+    "bor": (2, -1),
+    "eq": (2, -1),
+    "neq": (2, -1),
+    "dup": (1, 1),
+    "drop": (1, -1),
+    "pick": (None, 1),
+    "over": (2, 1),
+    "swap": (2, 0),
+    "rot": (3, 0),
+    "deref": (1, 0),
+    "deref_size": (1, 0),
+}
+
+_BINARY_OPS = {
+    "plus": operator.add,
+    "minus": operator.sub,
+    "div": operator.floordiv,
+    "mod": operator.mod,
+    "mul": operator.mul,
+    "shl": operator.lshift,
+    "shr": operator.rshift,
+    "xor": operator.xor,
+    "band": operator.and_,
+    "bor": operator.or_,
+    "eq": operator.eq,
+    "neq": operator.ne,
+}
+
+_UNARY_OPS = {
+    "neg": operator.neg,
+    "abs": abs,
+    "bnot": operator.invert,
+}
+
+
+def _op_const(s, m, value):
+    s.append(value)
+
+
+def _op_binary(s, m, fn):
+    a = s.pop()
+    s[-1] = fn(s[-1], a)
+
+
+def _op_unary(s, m, fn):
+    s[-1] = fn(s[-1])
+
+
+def _op_dup(s, m, _):
+    s.append(s[-1])
+
+
+def _op_drop(s, m, _):
+    s.pop()
+
+
+def _op_pick(s, m, index):
+    s.append(s[-1 - index])
+
+
+def _op_over(s, m, _):
+    s.append(s[-2])
+
+
+def _op_swap(s, m, _):
+    s.insert(-1, s.pop())
+
+
+def _op_rot(s, m, _):
+    s.insert(-2, s.pop())
+
+
+def _op_deref(s, m, _):
+    s[-1] = m._load(s[-1], m._address_size)
+
+
+def _op_deref_size(s, m, size):
+    s[-1] = m._load(s[-1], size)
+
+
+_HANDLERS = {
+    "const": _op_const,
+    "dup": _op_dup,
+    "drop": _op_drop,
+    "pick": _op_pick,
+    "over": _op_over,
+    "swap": _op_swap,
+    "rot": _op_rot,
+    "deref": _op_deref,
+    "deref_size": _op_deref_size,
+}
+
+
+# superinstructions produced by Program._fuse
+def _op_binary_const(s, m, arg):
+    fn, value = arg
+    s[-1] = fn(s[-1], value)
+
+
+def _op_binary_pick(s, m, arg):
+    fn, index = arg
+    s[-1] = fn(s[-1], s[-1 - index])
+
+
+def _op_load_const(s, m, arg):
+    addr, size = arg
+    s.append(m._load(addr, size))
+
+
+def _op_rot_rot(s, m, _):
+    s.append(s.pop(-3))
+
+
+def _op_rot_rot_drop(s, m, _):
+    del s[-3]
+
+
+def _op_over_over(s, m, _):
+    s.extend(s[-2:])
+
+
+# sequences of argument-less ops that collapse into a single handler
+_FUSED_SEQUENCES = {
+    ("rot", "rot", "drop"): _op_rot_rot_drop,
+    ("rot", "rot"): _op_rot_rot,
+    ("over", "over"): _op_over_over,
+}
+
+
+class Program:
+    """An immutable, pre-analysed sequence of StackMachine operations.
+
+    Use ProgramRecorder to build one, then run it with StackMachine.execute.
+    """
+
+    __slots__ = ("_ops", "_min_depth", "_max_depth", "_net_depth", "_code")
+
+    def __init__(self, ops):
+        ops = tuple(tuple(op) for op in ops)
+        depth = min_depth = max_depth = 0
+        for name, *args in ops:
+            if name not in _STACK_EFFECTS:
+                raise ValueError(f"unknown operation: {name}")
+            if name == "pick":
+                required, change = args[0] + 1, 1
+            elif name == "deref_size" and args[0] not in (1, 2, 4, 8):
+                raise ValueError("size must be one of (1, 2, 4, 8)")
+            else:
+                required, change = _STACK_EFFECTS[name]
+            min_depth = max(min_depth, required - depth)
+            depth += change
+            max_depth = max(max_depth, depth)
+        self._ops = ops
+        self._min_depth = min_depth
+        self._max_depth = max_depth
+        self._net_depth = depth
+        self._code = tuple(self._fuse(ops))
+
+    @property
+    def ops(self):
+        """The recorded operations as (name, *args) tuples."""
+        return self._ops
+
+    @property
+    def code(self):
+        """The (handler, arg) pairs executed by StackMachine.execute."""
+        return self._code
+
+    @property
+    def min_depth(self):
+        """Number of stack elements the program expects on entry."""
+        return self._min_depth
+
+    @property
+    def max_depth(self):
+        """Peak stack growth relative to the entry depth."""
+        return self._max_depth
+
+    @property
+    def net_depth(self):
+        """Stack growth after the program has finished."""
+        return self._net_depth
+
+    @staticmethod
+    def _fuse(ops, binary_ops=_BINARY_OPS, unary_ops=_UNARY_OPS):
+        names = tuple(op[0] for op in ops)
+        i = 0
+        while i < len(ops):
+            for sequence, handler in _FUSED_SEQUENCES.items():
+                if names[i : i + len(sequence)] == sequence:
+                    yield handler, None
+                    i += len(sequence)
+                    break
+            else:
+                sequence = None
+            if sequence is not None:
+                continue
+            name, *args = ops[i]
+            next_name = ops[i + 1][0] if i + 1 < len(ops) else None
+            if name in ("const", "pick") and next_name in binary_ops:
+                handler = _op_binary_const if name == "const" else _op_binary_pick
+                yield handler, (binary_ops[next_name], args[0])
+                i += 2
+                continue
+            if name == "const" and next_name == "deref_size":
+                yield _op_load_const, (args[0], ops[i + 1][1])
+                i += 2
+                continue
+            if name in binary_ops:
+                yield _op_binary, binary_ops[name]
+            elif name in unary_ops:
+                yield _op_unary, unary_ops[name]
+            else:
+                yield _HANDLERS[name], args[0] if args else None
+            i += 1
+
+    def __len__(self):
+        return len(self._ops)
+
+    def __eq__(self, other):
+        return isinstance(other, Program) and self._ops == other._ops
+
+    def __hash__(self):
+        return hash(self._ops)
+
+    def __repr__(self):
+        return f"Program({len(self._ops)} ops, min_depth={self._min_depth})"
+
+
+class ProgramRecorder:
+    """Records chained StackMachine calls instead of executing them.
+
+    Any function written against the StackMachine API, such as perform_round,
+    can be passed a recorder to capture its op sequence as a Program.
+    """
+
+    def __init__(self):
+        self._ops = []
+
+    def __getattr__(self, name):
+        if name not in _STACK_EFFECTS:
+            raise AttributeError(f"StackMachine has no operation {name!r}")
+
+        def record(*args):
+            self._ops.append((name, *args))
+            return self
+
+        return record
+
+    def build(self) -> Program:
+        return Program(self._ops)
+
+
+# op name -> expression template used by jit_compile
+_JIT_TEMPLATES = {
+    "plus": "({0} + {1})",
+    "minus": "({0} - {1})",
+    "div": "({0} // {1})",
+    "mod": "({0} % {1})",
+    "mul": "({0} * {1})",
+    "shl": "({0} << {1})",
+    "shr": "({0} >> {1})",
+    "xor": "({0} ^ {1})",
+    "band": "({0} & {1})",
+    "bor": "({0} | {1})",
+    "eq": "({0} == {1})",
+    "neq": "({0} != {1})",
+    "neg": "(-{0})",
+    "abs": "abs({0})",
+    "bnot": "(~{0})",
+}
+
+
+class _JitValue:
+    __slots__ = ("template", "args", "uses", "name", "const", "forced")
+
+    def __init__(self, template=None, args=(), name=None, const=None, forced=False):
+        self.template = template
+        self.args = args
+        self.uses = 0
+        self.name = name
+        self.const = const
+        # forced values are emitted even when unused, e.g. loads and divisions, which may fault
+        self.forced = forced
+        for arg in args:
+            arg.uses += 1
+
+    def render(self):
+        if self.name is not None:
+            return self.name
+        return self.template.format(*(arg.render() for arg in self.args))
+
+
+@lru_cache(maxsize=None)
+def jit_compile(program: Program, address_size=None):
+    """Compiles a program into a straight-line Python function.
+
+    The program is executed symbolically: stack slots become local variables,
+    stack shuffles disappear, constant operands are folded and values used only
+    once are inlined into their consumer. The result is a function
+    f(stack, load, address_size) that replaces program.min_depth entries on top
+    of stack with the program's outputs, reading memory through
+    load(addr, size). With address_size, every value wraps at address_size
+    bytes as in FixedWidthStackMachine, and load must return wrapped values.
+    Compiled functions are cached per program and address_size, and the
+    generated code is kept in f.source.
+    """
+    if address_size is None:
+        binary_ops, unary_ops, templates, helpers = _BINARY_OPS, _UNARY_OPS, _JIT_TEMPLATES, {}
+    else:
+        binary_ops, unary_ops, templates, helpers = _fixed_width_ops(address_size)
+    mask = None if address_size is None else (1 << (address_size * 8)) - 1
+    inputs = [_JitValue(name=f"i{n}") for n in range(program.min_depth)]
+    stack = list(inputs)
+    values = []
+
+    def push(template, *args, forced=False):
+        stack.append(_JitValue(template, args, forced=forced))
+        values.append(stack[-1])
+
+    def push_const(value):
+        stack.append(_JitValue(name=repr(value), const=value))
+
+    for name, *args in program.ops:
+        if name == "const":
+            push_const(args[0] if mask is None else args[0] & mask)
+        elif name in binary_ops:
+            a, b = stack.pop(), stack.pop()
+            if a.const is not None and b.const is not None:
+                push_const(binary_ops[name](b.const, a.const))
+            else:
+                push(templates[name], b, a, forced=name in ("div", "mod"))
+        elif name in unary_ops:
+            a = stack.pop()
+            if a.const is not None:
+                push_const(unary_ops[name](a.const))
+            else:
+                push(templates[name], a)
+        elif name == "deref" or name == "deref_size":
+            size = args[0] if args else "address_size"
+            # every load gets its own line, so loads run, and fault, in program order
+            push(f"load({{0}}, {size})", stack.pop(), forced=True)
+        elif name == "dup":
+            stack.append(stack[-1])
+        elif name == "drop":
+            stack.pop()
+        elif name == "pick":
+            stack.append(stack[-1 - args[0]])
+        elif name == "over":
+            stack.append(stack[-2])
+        elif name == "swap":
+            stack.insert(-1, stack.pop())
+        elif name == "rot":
+            stack.insert(-2, stack.pop())
+    for value in stack:
+        value.uses += 1
+
+    lines = ["def jitted(stack, load, address_size):"]
+    if inputs:
+        lines.append(f"    {', '.join(v.name for v in inputs)}, = stack[-{len(inputs)}:]")
+        lines.append(f"    del stack[-{len(inputs)}:]")
+    for n, value in enumerate(values):
+        if value.name is not None:
+            continue
+        if value.uses > 1 or value.forced and value.uses:
+            code = value.render()
+            value.name = f"t{n}"
+            lines.append(f"    {value.name} = {code}")
+        elif value.forced:
+            lines.append(f"    {value.render()}")
+    if stack:
+        lines.append(f"    stack.extend(({', '.join(v.render() for v in stack)},))")
+    if len(lines) == 1:
+        lines.append("    pass")
+    source = "\n".join(lines) + "\n"
+
+    namespace = dict(helpers)
+    exec(compile(source, f"<jit {hash(program):x}>", "exec"), namespace)
+    jitted = namespace["jitted"]
+    jitted.source = source
+    return jitted
+
+
+@lru_cache(maxsize=None)
+def _fixed_width_ops(address_size):
+    """Returns the binary ops, unary ops, JIT templates and JIT helpers of a fixed-width machine."""
+    mask = (1 << (address_size * 8)) - 1
+    sign_bit = 1 << (address_size * 8 - 1)
+    shift_mask = address_size * 8 - 1
+
+    def signed(value):
+        return value - (value & sign_bit) * 2
+
+    def sdiv(b, a):
+        a, b = signed(a), signed(b)
+        q = abs(b) // abs(a)
+        return (q if (a < 0) == (b < 0) else -q) & mask
+
+    def sabs(value):
+        return abs(signed(value)) & mask
+
+    binary_ops = {
+        **_BINARY_OPS,
+        "plus": lambda b, a: (b + a) & mask,
+        "minus": lambda b, a: (b - a) & mask,
+        "div": sdiv,
+        "mul": lambda b, a: (b * a) & mask,
+        "shl": lambda b, a: (b << (a & shift_mask)) & mask,
+        "shr": lambda b, a: b >> (a & shift_mask),
+    }
+    unary_ops = {
+        "neg": lambda a: -a & mask,
+        "abs": sabs,
+        "bnot": lambda a: ~a & mask,
+    }
+    templates = {
+        **_JIT_TEMPLATES,
+        "plus": f"(({{0}} + {{1}}) & {mask:#x})",
+        "minus": f"(({{0}} - {{1}}) & {mask:#x})",
+        "div": "sdiv({0}, {1})",
+        "mul": f"(({{0}} * {{1}}) & {mask:#x})",
+        "shl": f"(({{0}} << ({{1}} & {shift_mask})) & {mask:#x})",
+        "shr": f"({{0}} >> ({{1}} & {shift_mask}))",
+        "neg": f"(-{{0}} & {mask:#x})",
+        "abs": "sabs({0})",
+        "bnot": f"(~{{0}} & {mask:#x})",
+    }
+    return binary_ops, unary_ops, templates, {"sdiv": sdiv, "sabs": sabs}
+
+
+@lru_cache(maxsize=None)
+def _fixed_width_code(program: Program, address_size):
+    """Fuses program with the fixed-width ops of address_size, for FixedWidthStackMachine."""
+    mask = (1 << (address_size * 8)) - 1
+    ops = [("const", op[1] & mask) if op[0] == "const" else op for op in program.ops]
+    binary_ops, unary_ops, _, _ = _fixed_width_ops(address_size)
+    return tuple(Program._fuse(ops, binary_ops, unary_ops))
+
+
+class FixedWidthStackMachine(StackMachine):
+    """A StackMachine with the fixed-width semantics of libgcc's DWARF evaluator.
+
+    The stack is a preallocated array of address_size-byte words indexed by a
+    stack pointer and every result wraps at address_size bytes. div and abs
+    treat values as signed words, as execute_stack_op does.
+    """
+
+    _TYPECODES = {4: "I", 8: "Q"}
+
+    def __init__(self, address_size=8, mem_size=0x100000, stack_size=64):
+        if address_size not in self._TYPECODES:
+            raise ValueError("address_size must be one of (4, 8)")
+        super().__init__(address_size, mem_size)
+        self._stack = array(self._TYPECODES[address_size], bytes(address_size * stack_size))
+        self._sp = 0
+        self._mask = (1 << (address_size * 8)) - 1
+        self._sign_bit = 1 << (address_size * 8 - 1)
+        self._shift_mask = address_size * 8 - 1
+
+    def const(self, val):
+        self.__push(val)
+        return self
+
+    def plus(self):
+        a, b = self.__pop2()
+        return self.__push(b + a)
+
+    def minus(self):
+        a, b = self.__pop2()
+        return self.__push(b - a)
+
+    def div(self):
+        a, b = self.__pop2()
+        a, b = self.__signed(a), self.__signed(b)
+        q = abs(b) // abs(a)
+        return self.__push(q if (a < 0) == (b < 0) else -q)
+
+    def mod(self):
+        a, b = self.__pop2()
+        return self.__push(b % a)
+
+    def mul(self):
+        a, b = self.__pop2()
+        return self.__push(b * a)
+
+    def shl(self):
+        a, b = self.__pop2()
+        return self.__push(b << (a & self._shift_mask))
+
+    def shr(self):
+        a, b = self.__pop2()
+        return self.__push(b >> (a & self._shift_mask))
+
+    def xor(self):
+        a, b = self.__pop2()
+        return self.__push(b ^ a)
+
+    def neg(self):
+        return self.__push(-self.__pop())
+
+    def abs(self):
+        return self.__push(abs(self.__signed(self.__pop())))
+
+    def bnot(self):
+        return self.__push(~self.__pop())
+
+    def band(self):
+        a, b = self.__pop2()
+        return self.__push(b & a)
+
+    def bor(self):
+        a, b = self.__pop2()
+        return self.__push(b | a)
+
+    def eq(self):
+        a, b = self.__pop2()
+        return self.__push(b == a)
+
+    def neq(self):
+        a, b = self.__pop2()
+        return self.__push(b != a)
+
+    def dup(self):
+        self.__assert_elements(1)
+        return self.pick(0)
+
+    def drop(self):
+        self.__pop()
+        return self
+
+    def pick(self, index):
+        if index >= self._sp:
+            raise ValueError("index out of bound")
+        return self.__push(self._stack[self._sp - 1 - index])
+
+    def over(self):
+        self.__assert_elements(2)
+        return self.pick(1)
+
+    def swap(self):
+        self.__assert_elements(2)
+        s, sp = self._stack, self._sp
+        s[sp - 2], s[sp - 1] = s[sp - 1], s[sp - 2]
+        return self
+
+    def rot(self):
+        self.__assert_elements(3)
+        s, sp = self._stack, self._sp
+        s[sp - 3], s[sp - 2], s[sp - 1] = s[sp - 1], s[sp - 3], s[sp - 2]
+        return self
+
+    def deref(self):
+        return self.__push(self._load(self.__pop(), self._address_size))
+
+    def deref_size(self, size):
+        if size not in (1, 2, 4, 8):
+            raise ValueError("size must be one of (1, 2, 4, 8)")
+        return self.__push(self._load(self.__pop(), size))
+
+    def execute(self, program: Program, jit=False):
+        """Runs a recorded program with fixed-width semantics.
+
+        The top program.min_depth words are copied to a list, run through the
+        fused handlers (or the jit_compile function with jit=True) with
+        wrapping ops, and written back.
+        """
+        sp = self._sp
+        if sp < program.min_depth:
+            raise RuntimeError(f"stack must have at least {program.min_depth} elements")
+        if sp + program.max_depth > len(self._stack):
+            raise RuntimeError("stack overflow")
+        base = sp - program.min_depth
+        stack = self._stack[base:sp].tolist()
+        if jit:
+            jit_compile(program, self._address_size)(stack, self._load, self._address_size)
+        else:
+            for handler, arg in _fixed_width_code(program, self._address_size):
+                handler(stack, self, arg)
+        self._stack[base : base + len(stack)] = array(self._stack.typecode, stack)
+        self._sp = base + len(stack)
+        return self
+
+    def _load(self, addr, size):
+        return super()._load(addr, size) & self._mask
+
+    def debug(self):
+        print(self._stack[: self._sp].tolist()[::-1])
+        return self
+
+    def __push(self, value):
+        if self._sp == len(self._stack):
+            raise RuntimeError("stack overflow")
+        self._stack[self._sp] = value & self._mask
+        self._sp += 1
+        return self
+
+    def __pop(self):
+        self.__assert_elements(1)
+        self._sp -= 1
+        return self._stack[self._sp]
+
+    def __pop2(self):
+        self.__assert_elements(2)
+        self._sp -= 2
+        return self._stack[self._sp + 1], self._stack[self._sp]
+
+    def __signed(self, value):
+        return value - (value & self._sign_bit) * 2
+
+    def __assert_elements(self, n):
+        if self._sp < n:
+            raise RuntimeError(f"stack must have at least {n} elements")
+
+
+def perform_round(machine: StackMachine, delta=0x9E3779B9):
+    # initial state: [sum, v1, v0, k3, k2, k1, k0, ...]
+    # end state: [new_sum, new_v1, new_v0, k3, k2, k1, k0, ...]
+    (
+        machine.const(delta)  # [delta, sum, v1, v0, k3, k2, k1, k0]
+        .plus()  # [new_sum, v1, v0, k3, k2, k1, k0]
+        .const(0xFFFFFFFF)
+        .band()
+        .rot()  # [v1, v0, new_sum, k3, k2, k1, k0]
+        .over()  # [v0, v1, v0, new_sum, k3, k2, k1, k0]
+        .over()  # [v1, v0, v1, v0, new_sum, k3, k2, k1, k0]
+        .const(4)
+        .shl()  # [v1<<4, v0, v1, v0, new_sum, k3, k2, k1, k0]
+        .pick(8)  # [k0, v1<<4, v0, v1, v0, new_sum, k3, k2, k1, k0]
+        .plus()  # [k0+(v1<<4), v0, v1, v0, new_sum, k3, k2, k1, k0]
+        .pick(2)  # [v1, k0+(v1<<4), v0, v1, v0, new_sum, k3, k2, k1, k0]
+        .pick(5)  # [new_sum, v1, k0+(v1<<4), v0, v1, v0, new_sum, k3, k2, k1, k0]
+        .plus()  # [v1+new_sum, k0+(v1<<4), v0, v1, v0, new_sum, k3, k2, k1, k0]
+        .pick(3)  # [v1, v1+new_sum, k0+(v1<<4), v0, v1, v0, new_sum, k3, k2, k1, k0]
+        .const(5)
+        .shr()  # [v1>>5, v1+new_sum, k0+(v1<<4), v0, v1, v0, new_sum, k3, k2, k1, k0]
+        .pick(9)
+        .plus()  # [k1+(v1>>5), v1+new_sum, k0+(v1<<4), v0, v1, v0, new_sum, k3, k2, k1, k0]
+        .xor()
+        .xor()  # [k1+(v1>>5)^v1+new_sum^k0+(v1<<4), v0, v1, v0, new_sum, k3, k2, k1, k0]
+        .plus()  # [new_v0, v1, v0, new_sum, k3, k2, k1, k0]
+        .const(0xFFFFFFFF)
+        .band()
+        .rot()  # [v1, v0, new_v0, new_sum, k3, k2, k1, k0]
+        .rot()  # [v0, new_v0, v1, new_sum, k3, k2, k1, k0]
+        .drop()  # [new_v0, v1, new_sum, k3, k2, k1, k0]
+        .swap()  # [v1, new_v0, new_sum, k3, k2, k1, k0]
+        .over()  # [new_v0, v1, new_v0, new_sum, k3, k2, k1, k0]
+        .const(4)
+        .shl()  # [new_v0<<4, v1, new_v0, new_sum, k3, k2, k1, k0]
+        .pick(5)  # [k2, new_v0<<4, v1, new_v0, new_sum, k3, k2, k1, k0]
+        .plus()  # [k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
+        .pick(2)  # [new_v0, k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
+        .pick(4)  # [new_sum, new_v0, k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
+        .plus()  # [new_sum+new_v0, k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
+        .pick(3)  # [new_v0, new_sum+new_v0, k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
+        .const(5)
+        .shr()  # [new_v0>>5, new_sum+new_v0, k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
+        .pick(
+            6
+        )  # [k3, new_v0>>5, new_sum+new_v0, k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
+        .plus()  # [k3+(new_v0>>5), new_sum+new_v0, k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
+        .xor()
+        .xor()  # [k3+(new_v0>>5)^new_sum+new_v0^k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
+        .plus()  # [new_v1, new_v0, new_sum, k3, k2, k1, k0]
+        .const(0xFFFFFFFF)
+        .band()
+        .rot()  # [new_v0, new_sum, new_v1, k3, k2, k1, k0]
+        .rot()  # [new_sum, new_v1, new_v0, k3, k2, k1, k0]
+    )
+
+
+def tea_encrypt_block(
+    machine: StackMachine, block_addr: int, key_addr: int, delta=0x9E3779B9, rounds=32
+):
+    (
+        machine.const(key_addr)
+        .deref_size(4)
+        .const(key_addr + 4)
+        .deref_size(4)
+        .const(key_addr + 8)
+        .deref_size(4)
+        .const(key_addr + 12)
+        .deref_size(4)
+        .const(block_addr)
+        .deref_size(4)
+        .const(block_addr + 4)
+        .deref_size(4)
+        .const(0)
+    )
+    # state: [sum, v1, v0, k3, k2, k1, k0, ...]
+    for _ in range(rounds):
+        perform_round(machine, delta=delta)
+    # state: [new_sum, new_v1, new_v0, k3, k2, k1, k0, ...]
+    (
+        machine.drop()  # [new_v1, new_v0, k3, k2, k1, k0]
+        .rot()  # [new_v0, k3, new_v1, k2 ,k1, k0]
+        .rot()  # [k3, new_v1, new_v0, k2 ,k1, k0]
+        .drop()  # [new_v1, new_v0, k2 ,k1, k0]
+        .rot()  # [new_v0, k2, new_v1, k1, k0]
+        .rot()  # [k2, new_v1, new_v0, k1, k0]
+        .drop()  # [new_v1, new_v0, k1, k0]
+        .rot()  # [new_v0, k1, new_v1, k0]
+        .rot()  # [k1, new_v1, new_v0, k0]
+        .drop()  # [new_v1, new_v0, k0]
+        .rot()  # [new_v0, k0, new_v1]
+        .rot()  # [k0, new_v1, new_v0]
+        .drop()  # [new_v1, new_v0]
+    )
+
+
+@lru_cache(maxsize=None)
+def tea_encrypt_block_program(block_addr: int, key_addr: int, delta=0x9E3779B9, rounds=32):
+    recorder = ProgramRecorder()
+    tea_encrypt_block(recorder, block_addr, key_addr, delta=delta, rounds=rounds)
+    return recorder.build()
+
+
+def tea_encrypt(plaintext: bytes | bytearray, key: bytes | bytearray, delta=0x9E3779B9, rounds=32):
+    machine = StackMachine()
+    machine.store(0, key[:0x10])
+    machine.store(0x10, plaintext)
+    block_size = 8
+    num_blocks = math.ceil(len(plaintext) / block_size)
+    for i in range(num_blocks):
+        program = tea_encrypt_block_program(0x10 + i * block_size, 0, delta=delta, rounds=rounds)
+        machine.execute(program)
+    return machine
+
+
 if __name__ == "__main__":
     # StackMachine().const(1000).const(29).const(17).dup().debug()
     # StackMachine().const(1000).const(29).const(17).drop().debug()
@@ -199,114 +1036,6 @@ if __name__ == "__main__":
     # StackMachine().const(1000).const(29).const(17).swap().debug()
     # StackMachine().const(1000).const(29).const(17).debug().rot().debug()
 
-    def perform_round(machine: StackMachine, delta=0x9E3779B9):
-        # initial state: [sum, v1, v0, k3, k2, k1, k0, ...]
-        # end state: [new_sum, new_v1, new_v0, k3, k2, k1, k0, ...]
-        (
-            machine.const(delta)  # [delta, sum, v1, v0, k3, k2, k1, k0]
-            .plus()  # [new_sum, v1, v0, k3, k2, k1, k0]
-            .const(0xFFFFFFFF)
-            .band()
-            .rot()  # [v1, v0, new_sum, k3, k2, k1, k0]
-            .over()  # [v0, v1, v0, new_sum, k3, k2, k1, k0]
-            .over()  # [v1, v0, v1, v0, new_sum, k3, k2, k1, k0]
-            .const(4)
-            .shl()  # [v1<<4, v0, v1, v0, new_sum, k3, k2, k1, k0]
-            .pick(8)  # [k0, v1<<4, v0, v1, v0, new_sum, k3, k2, k1, k0]
-            .plus()  # [k0+(v1<<4), v0, v1, v0, new_sum, k3, k2, k1, k0]
-            .pick(2)  # [v1, k0+(v1<<4), v0, v1, v0, new_sum, k3, k2, k1, k0]
-            .pick(5)  # [new_sum, v1, k0+(v1<<4), v0, v1, v0, new_sum, k3, k2, k1, k0]
-            .plus()  # [v1+new_sum, k0+(v1<<4), v0, v1, v0, new_sum, k3, k2, k1, k0]
-            .pick(3)  # [v1, v1+new_sum, k0+(v1<<4), v0, v1, v0, new_sum, k3, k2, k1, k0]
-            .const(5)
-            .shr()  # [v1>>5, v1+new_sum, k0+(v1<<4), v0, v1, v0, new_sum, k3, k2, k1, k0]
-            .pick(9)
-            .plus()  # [k1+(v1>>5), v1+new_sum, k0+(v1<<4), v0, v1, v0, new_sum, k3, k2, k1, k0]
-            .xor()
-            .xor()  # [k1+(v1>>5)^v1+new_sum^k0+(v1<<4), v0, v1, v0, new_sum, k3, k2, k1, k0]
-            .plus()  # [new_v0, v1, v0, new_sum, k3, k2, k1, k0]
-            .const(0xFFFFFFFF)
-            .band()
-            .rot()  # [v1, v0, new_v0, new_sum, k3, k2, k1, k0]
-            .rot()  # [v0, new_v0, v1, new_sum, k3, k2, k1, k0]
-            .drop()  # [new_v0, v1, new_sum, k3, k2, k1, k0]
-            .swap()  # [v1, new_v0, new_sum, k3, k2, k1, k0]
-            .over()  # [new_v0, v1, new_v0, new_sum, k3, k2, k1, k0]
-            .const(4)
-            .shl()  # [new_v0<<4, v1, new_v0, new_sum, k3, k2, k1, k0]
-            .pick(5)  # [k2, new_v0<<4, v1, new_v0, new_sum, k3, k2, k1, k0]
-            .plus()  # [k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
-            .pick(2)  # [new_v0, k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
-            .pick(4)  # [new_sum, new_v0, k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
-            .plus()  # [new_sum+new_v0, k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
-            .pick(
-                3
-            )  # [new_v0, new_sum+new_v0, k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
-            .const(5)
-            .shr()  # [new_v0>>5, new_sum+new_v0, k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
-            .pick(
-                6
-            )  # [k3, new_v0>>5, new_sum+new_v0, k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
-            .plus()  # [k3+(new_v0>>5), new_sum+new_v0, k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
-            .xor()
-            .xor()  # [k3+(new_v0>>5)^new_sum+new_v0^k2+(new_v0<<4), v1, new_v0, new_sum, k3, k2, k1, k0]
-            .plus()  # [new_v1, new_v0, new_sum, k3, k2, k1, k0]
-            .const(0xFFFFFFFF)
-            .band()
-            .rot()  # [new_v0, new_sum, new_v1, k3, k2, k1, k0]
-            .rot()  # [new_sum, new_v1, new_v0, k3, k2, k1, k0]
-        )
-
-    def tea_encrypt_block(
-        machine: StackMachine, block_addr: int, key_addr: int, delta=0x9E3779B9, rounds=32
-    ):
-        (
-            machine.const(key_addr)
-            .deref_size(4)
-            .const(key_addr + 4)
-            .deref_size(4)
-            .const(key_addr + 8)
-            .deref_size(4)
-            .const(key_addr + 12)
-            .deref_size(4)
-            .const(block_addr)
-            .deref_size(4)
-            .const(block_addr + 4)
-            .deref_size(4)
-            .const(0)
-        )
-        # state: [sum, v1, v0, k3, k2, k1, k0, ...]
-        for _ in range(rounds):
-            perform_round(machine, delta=delta)
-        # state: [new_sum, new_v1, new_v0, k3, k2, k1, k0, ...]
-        (
-            machine.drop()  # [new_v1, new_v0, k3, k2, k1, k0]
-            .rot()  # [new_v0, k3, new_v1, k2 ,k1, k0]
-            .rot()  # [k3, new_v1, new_v0, k2 ,k1, k0]
-            .drop()  # [new_v1, new_v0, k2 ,k1, k0]
-            .rot()  # [new_v0, k2, new_v1, k1, k0]
-            .rot()  # [k2, new_v1, new_v0, k1, k0]
-            .drop()  # [new_v1, new_v0, k1, k0]
-            .rot()  # [new_v0, k1, new_v1, k0]
-            .rot()  # [k1, new_v1, new_v0, k0]
-            .drop()  # [new_v1, new_v0, k0]
-            .rot()  # [new_v0, k0, new_v1]
-            .rot()  # [k0, new_v1, new_v0]
-            .drop()  # [new_v1, new_v0]
-        )
-
-    def tea_encrypt(
-        plaintext: bytes | bytearray, key: bytes | bytearray, delta=0x9E3779B9, rounds=32
-    ):
-        machine = StackMachine()
-        machine.store(0, key[:0x10])
-        machine.store(0x10, plaintext)
-        block_size = 8
-        num_blocks = math.ceil(len(plaintext) / block_size)
-        for i in range(num_blocks):
-            tea_encrypt_block(machine, 0x10 + i * block_size, 0, delta=delta, rounds=rounds)
-        return machine
-
     machine = tea_encrypt(
         b"ARKAV{this_chall_is_as_treacherous_as_lost_from_light!!}",
         bytes.fromhex("dc9e3ac003ca259f20f6a5ad6ecfbce8"),
@@ -1,26 +1,46 @@
 import struct
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-def encrypt_block(v, k, delta, rounds):
-    v0, v1 = struct.unpack("<2L", v)
-    k0, k1, k2, k3 = struct.unpack("<4L", k)
+
+_BLOCK = struct.Struct("<2L")
+_KEY = struct.Struct("<4L")
+# below this many blocks (lanes times blocks for the _many functions) NumPy's fixed per-round
+# overhead costs more than the plain-int loop, about 20 blocks at any round count
+_NUMPY_MIN_BLOCKS = 20
+
+
+def _use_numpy(blocks):
+    return np is not None and blocks >= _NUMPY_MIN_BLOCKS
+
+
+def _encrypt_words(v0, v1, k0, k1, k2, k3, delta, rounds):
     s = 0
     for _ in range(rounds):
         s = (s + delta) & 0xFFFFFFFF
         v0 = (v0 + (((v1 << 4) + k0) ^ (v1 + s) ^ ((v1 >> 5) + k1))) & 0xFFFFFFFF
         v1 = (v1 + (((v0 << 4) + k2) ^ (v0 + s) ^ ((v0 >> 5) + k3))) & 0xFFFFFFFF
-    return struct.pack("<2L", v0, v1)
+    return v0, v1
 
 
-def decrypt_block(v, k, delta, rounds):
-    v0, v1 = struct.unpack("<2L", v)
-    k0, k1, k2, k3 = struct.unpack("<4L", k)
+def _decrypt_words(v0, v1, k0, k1, k2, k3, delta, rounds):
     s = (delta * rounds) & 0xFFFFFFFF
     for _ in range(rounds):
         v1 = (v1 - (((v0 << 4) + k2) ^ (v0 + s) ^ ((v0 >> 5) + k3))) & 0xFFFFFFFF
         v0 = (v0 - (((v1 << 4) + k0) ^ (v1 + s) ^ ((v1 >> 5) + k1))) & 0xFFFFFFFF
         s = (s - delta) & 0xFFFFFFFF
-    return struct.pack("<2L", v0, v1)
+    return v0, v1
+
+
+def encrypt_block(v, k, delta, rounds):
+    return _BLOCK.pack(*_encrypt_words(*_BLOCK.unpack(v), *_KEY.unpack(k), delta, rounds))
+
+
+def decrypt_block(v, k, delta, rounds):
+    return _BLOCK.pack(*_decrypt_words(*_BLOCK.unpack(v), *_KEY.unpack(k), delta, rounds))
 
 
 def null_pad(data: bytes, block_size=8) -> bytes:
@@ -34,10 +54,109 @@ def null_unpad(data: bytes) -> bytes:
     return data.rstrip(b"\x00")
 
 
+def _tea_lanes(v, k, delta, rounds, inverse=False):
+    """Runs TEA over a (lanes, blocks, 2) uint32 array with (lanes, 4) keys and (lanes,) deltas.
+
+    Any of the lane axes may be 1 and is broadcast against the others.
+    """
+    v0, v1 = v[..., 0], v[..., 1]
+    k0, k1, k2, k3 = (k[:, i, None] for i in range(4))
+    delta = delta[:, None]
+    if not inverse:
+        s = np.zeros_like(delta)
+        for _ in range(rounds):
+            s = s + delta
+            v0 = v0 + (((v1 << 4) + k0) ^ (v1 + s) ^ ((v1 >> 5) + k1))
+            v1 = v1 + (((v0 << 4) + k2) ^ (v0 + s) ^ ((v0 >> 5) + k3))
+    else:
+        s = delta * np.uint32(rounds & 0xFFFFFFFF)
+        for _ in range(rounds):
+            v1 = v1 - (((v0 << 4) + k2) ^ (v0 + s) ^ ((v0 >> 5) + k3))
+            v0 = v0 - (((v1 << 4) + k0) ^ (v1 + s) ^ ((v1 >> 5) + k1))
+            s = s - delta
+    return np.stack(np.broadcast_arrays(v0, v1), axis=-1).astype("<u4", copy=False)
+
+
+def _broadcast(messages, keys, deltas):
+    messages = [messages] if isinstance(messages, (bytes, bytearray, memoryview)) else messages
+    keys = [keys] if isinstance(keys, (bytes, bytearray, memoryview)) else keys
+    deltas = [deltas] if isinstance(deltas, int) else deltas
+    messages, keys, deltas = (list(map(bytes, messages)), list(map(bytes, keys)), list(deltas))
+    lengths = {len(messages), len(keys), len(deltas)} - {1}
+    if len(lengths) > 1:
+        raise ValueError(
+            "messages, keys and deltas must each have 1 entry or the same number of entries, "
+            f"got {len(messages)}, {len(keys)} and {len(deltas)}"
+        )
+    # an empty sequence means no lanes at all
+    lanes = lengths.pop() if lengths else 1
+    if any(len(key) != 16 for key in keys):
+        raise ValueError("Key must be 16 bytes")
+    return messages, keys, deltas, lanes
+
+
+def _run_lanes(messages, keys, deltas, rounds, inverse):
+    size = max(map(len, messages))
+    v = np.zeros((len(messages), size), dtype=np.uint8)
+    for row, message in zip(v, messages):
+        row[: len(message)] = np.frombuffer(message, dtype=np.uint8)
+    v = v.view("<u4").reshape(len(messages), -1, 2)
+    k = np.frombuffer(b"".join(keys), dtype="<u4").reshape(-1, 4)
+    d = np.array([delta & 0xFFFFFFFF for delta in deltas], dtype=np.uint32)
+    result = _tea_lanes(v, k, d, rounds, inverse)
+    return result.view(np.uint8).reshape(result.shape[0], size)
+
+
+def encrypt_many(messages, keys, deltas=0x9E3779B9, rounds=32) -> list[bytes]:
+    """Encrypts lane i of messages under keys[i] and deltas[i].
+
+    Each argument is a sequence with one entry per lane or a single value that
+    is used for every lane, so one message can be tried under many keys or
+    deltas and many messages under one key. An empty sequence means no
+    lanes and gives []. Messages are null-padded independently and may differ
+    in length. Deltas wrap to 32 bits, as in encrypt.
+    """
+    messages, keys, deltas, lanes = _broadcast(messages, keys, deltas)
+    if not lanes:
+        return []
+    messages = [null_pad(m) for m in messages]
+    if not _use_numpy(lanes * max(map(len, messages)) // 8):
+        return [
+            encrypt(
+                messages[i % len(messages)], keys[i % len(keys)], deltas[i % len(deltas)], rounds
+            )
+            for i in range(lanes)
+        ]
+    result = _run_lanes(messages, keys, deltas, rounds, inverse=False)
+    lengths = [len(m) for m in messages] * (lanes // len(messages))
+    return [row[:n].tobytes() for row, n in zip(result, lengths)]
+
+
+def decrypt_many(messages, keys, deltas=0x9E3779B9, rounds=32) -> list[bytes]:
+    """Decrypts lane i of messages under keys[i] and deltas[i]; see encrypt_many."""
+    messages, keys, deltas, lanes = _broadcast(messages, keys, deltas)
+    if not lanes:
+        return []
+    if any(len(m) % 8 != 0 for m in messages):
+        raise ValueError("Ciphertext must be a multiple of 8 bytes")
+    if not _use_numpy(lanes * max(map(len, messages)) // 8):
+        return [
+            decrypt(
+                messages[i % len(messages)], keys[i % len(keys)], deltas[i % len(deltas)], rounds
+            )
+            for i in range(lanes)
+        ]
+    result = _run_lanes(messages, keys, deltas, rounds, inverse=True)
+    lengths = [len(m) for m in messages] * (lanes // len(messages))
+    return [null_unpad(row[:n].tobytes()) for row, n in zip(result, lengths)]
+
+
 def encrypt(data: bytes, key: bytes, delta=0x9E3779B9, rounds=32) -> bytes:
     if len(key) != 16:
         raise ValueError("Key must be 16 bytes")
     data = null_pad(data)
+    if _use_numpy(len(data) // 8):
+        return _run_lanes([data], [key], [delta], rounds, inverse=False).tobytes()
     result = bytearray()
     for i in range(0, len(data), 8):
         block = data[i : i + 8]
@@ -51,9 +170,106 @@ def decrypt(data: bytes, key: bytes, delta=0x9E3779B9, rounds=32) -> bytes:
         raise ValueError("Key must be 16 bytes")
     if len(data) % 8 != 0:
         raise ValueError("Ciphertext must be a multiple of 8 bytes")
+    if _use_numpy(len(data) // 8):
+        return null_unpad(_run_lanes([data], [key], [delta], rounds, inverse=True).tobytes())
     result = bytearray()
     for i in range(0, len(data), 8):
         block = data[i : i + 8]
         decrypted = decrypt_block(block, key, delta, rounds)
         result.extend(decrypted)
     return null_unpad(bytes(result))
+
+
+def _read_chunks(source, chunk_size):
+    """Yields memoryviews of at most chunk_size bytes from a file object or an iterable."""
+    if hasattr(source, "readinto"):
+        buffer = memoryview(bytearray(chunk_size))
+        while n := source.readinto(buffer):
+            yield buffer[:n]
+        return
+    if hasattr(source, "read"):
+        source = iter(lambda: source.read(chunk_size), b"")
+    for chunk in source:
+        chunk = memoryview(chunk).cast("B")
+        for i in range(0, len(chunk), chunk_size):
+            yield chunk[i : i + chunk_size]
+
+
+def _crypt_into(dst, src, key, delta, rounds, inverse):
+    """Encrypts or decrypts the whole blocks of src into dst, both memoryviews of equal size."""
+    if _use_numpy(len(src) // 8):
+        v = np.frombuffer(src, dtype="<u4").reshape(1, -1, 2)
+        k = np.frombuffer(key, dtype="<u4").reshape(1, 4)
+        d = np.array([delta & 0xFFFFFFFF], dtype=np.uint32)
+        out = _tea_lanes(v, k, d, rounds, inverse)
+        np.frombuffer(dst, dtype=np.uint8)[:] = out.view(np.uint8).reshape(-1)
+        return
+    words = _KEY.unpack(key)
+    crypt = _decrypt_words if inverse else _encrypt_words
+    for offset, (v0, v1) in zip(range(0, len(src), 8), _BLOCK.iter_unpack(src)):
+        _BLOCK.pack_into(dst, offset, *crypt(v0, v1, *words, delta, rounds))
+
+
+def _crypt_stream(source, key, delta, rounds, chunk_size, inverse):
+    if len(key) != 16:
+        raise ValueError("Key must be 16 bytes")
+    key = bytes(key)
+    out = bytearray()
+    carry = bytearray()
+    for chunk in _read_chunks(source, chunk_size):
+        if carry:
+            take = min(8 - len(carry), len(chunk))
+            carry += chunk[:take]
+            chunk = chunk[take:]
+            if len(carry) < 8:
+                continue
+        whole = len(chunk) - len(chunk) % 8
+        size = len(carry) + whole
+        if size:
+            if len(out) < size:
+                # never resize in place: earlier chunks may still be exported
+                out = bytearray(size)
+            view = memoryview(out)[:size]
+            if carry:
+                _crypt_into(view[:8], bytes(carry), key, delta, rounds, inverse)
+                carry.clear()
+            _crypt_into(view[size - whole :], chunk[:whole], key, delta, rounds, inverse)
+            yield view
+        carry += chunk[whole:]
+    if carry:
+        if inverse:
+            raise ValueError("Ciphertext must be a multiple of 8 bytes")
+        block = memoryview(bytearray(8))
+        _crypt_into(block, null_pad(bytes(carry)), key, delta, rounds, inverse)
+        yield block
+
+
+def encrypt_stream(source, key: bytes, delta=0x9E3779B9, rounds=32, chunk_size=1 << 16):
+    """Yields the ciphertext of a binary file object or an iterable of bytes-like chunks.
+
+    Blocks may straddle chunk boundaries and the last partial block is
+    null-padded, so the concatenated output equals encrypt() of the
+    concatenated input. Input chunks larger than chunk_size (e.g. an mmap) are
+    sliced, not copied. The yielded memoryviews point into a reused buffer and
+    are only valid until the next chunk is requested.
+    """
+    yield from _crypt_stream(source, key, delta, rounds, chunk_size, inverse=False)
+
+
+def decrypt_stream(source, key: bytes, delta=0x9E3779B9, rounds=32, chunk_size=1 << 16):
+    """Yields the plaintext of a ciphertext stream; see encrypt_stream.
+
+    Trailing null bytes are held back until more non-null output follows, so
+    the concatenated output equals decrypt() of the concatenated input.
+    """
+    pending = 0
+    for view in _crypt_stream(source, key, delta, rounds, chunk_size, inverse=True):
+        end = len(view)
+        while end and view[end - 1] == 0:
+            end -= 1
+        if end:
+            if pending:
+                yield memoryview(bytes(pending))
+            yield view[:end]
+            pending = 0
+        pending += len(view) - end
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from tea import decrypt, decrypt_block
+
+
+class SearchSpace:
+    """The cartesian product keys x deltas x rounds, addressed by a flat index.
+
+    deltas and rounds may be ranges, so a full 32-bit delta sweep never has to
+    be materialised.
+    """
+
+    def __init__(self, keys, deltas, rounds):
+        self.keys = [bytes(key) for key in keys]
+        self.deltas = deltas
+        self.rounds = rounds
+        if any(len(key) != 16 for key in self.keys):
+            raise ValueError("Key must be 16 bytes")
+
+    def __len__(self):
+        return len(self.keys) * len(self.deltas) * len(self.rounds)
+
+    def __getitem__(self, index):
+        index, r = divmod(index, len(self.rounds))
+        k, d = divmod(index, len(self.deltas))
+        return self.keys[k], self.deltas[d], self.rounds[r]
+
+    def describe(self):
+        """A JSON-friendly description, used to tell checkpoints of different searches apart."""
+        return {
+            "keys": [key.hex() for key in self.keys],
+            "deltas": _describe_sequence(self.deltas),
+            "rounds": _describe_sequence(self.rounds),
+        }
+
+
+def _describe_sequence(values):
+    if isinstance(values, range):
+        return [values.start, values.stop, values.step]
+    return list(values)
+
+
+_worker = None
+
+
+def _init_worker(space, ciphertext, prefix):
+    global _worker
+    _worker = (space, ciphertext, prefix)
+
+
+def _search_chunk(bounds):
+    """Tries every candidate in [start, stop) and returns (start, matches)."""
+    space, ciphertext, prefix = _worker
+    start, stop = bounds
+    first_block = ciphertext[:8]
+    block_prefix = prefix[:8]
+    matches = []
+    for index in range(start, stop):
+        key, delta, rounds = space[index]
+        if not decrypt_block(first_block, key, delta, rounds).startswith(block_prefix):
+            continue
+        plaintext = decrypt(ciphertext, key, delta, rounds)
+        if plaintext.startswith(prefix):
+            matches.append((index, plaintext))
+    return start, matches
+
+
+class Checkpoint:
+    """Completed chunks and matches, persisted as JSON so a search can resume.
+
+    Chunks are tracked by their start index. Everything below `watermark` is
+    done; chunks finished out of order are kept in `done` until the watermark
+    catches up with them.
+    """
+
+    def __init__(self, path, space, chunk_size):
+        self.path = path
+        self.header = {"space": space.describe(), "chunk_size": chunk_size}
+        self.chunk_size = chunk_size
+        self.watermark = 0
+        self.done = set()
+        self.matches = []
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state["header"] != self.header:
+                raise ValueError(f"{path} was written for a different search")
+            self.watermark = state["watermark"]
+            self.done = set(state["done"])
+            self.matches = [tuple(match) for match in state["matches"]]
+
+    def is_done(self, start):
+        return start < self.watermark or start in self.done
+
+    def complete(self, start, matches):
+        self.done.add(start)
+        self.matches.extend((index, plaintext.hex()) for index, plaintext in matches)
+        while self.watermark in self.done:
+            self.done.remove(self.watermark)
+            self.watermark += self.chunk_size
+
+    def save(self):
+        if not self.path:
+            return
+        state = {
+            "header": self.header,
+            "watermark": self.watermark,
+            "done": sorted(self.done),
+            "matches": self.matches,
+        }
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+
+def search(
+    space: SearchSpace,
+    ciphertext: bytes,
+    prefix: bytes,
+    processes=None,
+    chunk_size=1 << 14,
+    checkpoint=None,
+    report_interval=2.0,
+    log=sys.stderr,
+):
+    """Returns [(key, delta, rounds, plaintext)] whose decryption of ciphertext starts with prefix.
+
+    Only the first block is decrypted for most candidates; the full
+    ciphertext is decrypted only when that block already matches. The space
+    is split into chunks that a process pool works through. If checkpoint
+    names a file, progress is saved there and a later call resumes from it.
+    """
+    if len(ciphertext) < 8 or len(ciphertext) % 8 != 0:
+        raise ValueError("Ciphertext must be a non-empty multiple of 8 bytes")
+    state = Checkpoint(checkpoint, space, chunk_size)
+    total = len(space)
+    # the pool pulls chunks lazily while results update state, so decide from a snapshot
+    watermark, done = state.watermark, frozenset(state.done)
+    chunks = (
+        (start, min(start + chunk_size, total))
+        for start in range(watermark, total, chunk_size)
+        if start not in done
+    )
+    remaining = (
+        total - min(watermark, total) - sum(min(chunk_size, total - start) for start in done)
+    )
+    if log and remaining < total:
+        print(f"resuming: {total - remaining}/{total} candidates already tried", file=log)
+
+    tried = 0
+    began = last_report = time.perf_counter()
+    with multiprocessing.Pool(processes, _init_worker, (space, ciphertext, prefix)) as pool:
+        for start, matches in pool.imap_unordered(_search_chunk, chunks):
+            state.complete(start, matches)
+            tried += min(start + chunk_size, total) - start
+            now = time.perf_counter()
+            if matches or now - last_report >= report_interval:
+                state.save()
+                last_report = now
+                if log:
+                    rate = tried / (now - began)
+                    print(
+                        f"{total - remaining + tried}/{total} candidates, {rate:,.0f}/s, "
+                        f"{len(state.matches)} matches",
+                        file=log,
+                    )
+    state.save()
+    if log:
+        elapsed = time.perf_counter() - began
+        print(f"tried {tried} candidates in {elapsed:.2f}s ({tried / elapsed:,.0f}/s)", file=log)
+    return [(*space[index], bytes.fromhex(plaintext)) for index, plaintext in state.matches]
+
+
+def _int_range(text):
+    """Parses "N", "START:STOP" or "START:STOP:STEP" (any int literal) into a range."""
+    parts = [int(part, 0) for part in text.split(":")]
+    if len(parts) == 1:
+        return range(parts[0], parts[0] + 1)
+    return range(*parts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Search TEA keys, deltas and round counts for a known plaintext prefix"
+    )
+    parser.add_argument("ciphertext", help="ciphertext as hex")
+    parser.add_argument("-p", "--prefix", default="ARKAV{", help="known plaintext prefix")
+    parser.add_argument(
+        "-k", "--key", action="append", default=[], help="candidate key as hex (repeatable)"
+    )
+    parser.add_argument("--key-file", help="file with one hex key per line")
+    parser.add_argument(
+        "-d",
+        "--delta",
+        type=_int_range,
+        default=range(0x9E3779B9, 0x9E3779BA),
+        help="delta or START:STOP[:STEP]",
+    )
+    parser.add_argument(
+        "-r", "--rounds", type=_int_range, default=range(1, 65), help="rounds or START:STOP[:STEP]"
+    )
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes")
+    parser.add_argument("--chunk-size", type=int, default=1 << 14)
+    parser.add_argument("-c", "--checkpoint", help="checkpoint file to save to and resume from")
+    args = parser.parse_args()
+
+    keys = [bytes.fromhex(key) for key in args.key]
+    if args.key_file:
+        with open(args.key_file) as f:
+            keys += [bytes.fromhex(line) for line in f.read().split()]
+    if not keys:
+        parser.error("at least one key is required")
+
+    space = SearchSpace(keys, args.delta, args.rounds)
+    results = search(
+        space,
+        bytes.fromhex(args.ciphertext),
+        args.prefix.encode(),
+        processes=args.jobs,
+        chunk_size=args.chunk_size,
+        checkpoint=args.checkpoint,
+    )
+    for key, delta, rounds, plaintext in results:
+        print(f"key={key.hex()} delta={delta:#x} rounds={rounds} plaintext={plaintext!r}")
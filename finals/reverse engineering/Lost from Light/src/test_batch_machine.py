@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from batch_machine import BatchStackMachine, batch_tea_encrypt  # noqa: E402
+from stack_machine import FixedWidthStackMachine, ProgramRecorder, tea_encrypt  # noqa: E402
+
+LANES = 16
+# each lane loads its own words, then every op wraps: negative constants and results, signed div
+# and abs, shift counts past 64
+OPS = [
+    ("const", 0),
+    ("deref",),
+    ("const", 8),
+    ("deref",),
+    ("const", 16),
+    ("deref_size", 4),
+    ("const", -5),
+    ("minus",),
+    ("over",),
+    ("neg",),
+    ("div",),
+    ("abs",),
+    ("const", 1 << 70),
+    ("plus",),
+    ("const", 67),
+    ("shl",),
+    ("pick", 1),
+    ("const", 35),
+    ("shr",),
+    ("mul",),
+    ("bnot",),
+    ("over",),
+    ("mod",),
+    ("const", 24),
+    ("deref_size", 2),
+    ("xor",),
+    ("over",),
+    ("neq",),
+    ("rot",),
+    ("dup",),
+    ("band",),
+    ("bor",),
+    ("swap",),
+    ("eq",),
+    ("const", -1),
+]
+
+
+def test_lanes_match_fixed_width_machine():
+    images = [os.urandom(32) for _ in range(LANES)]
+    batch = BatchStackMachine(LANES)
+    batch.store(0, np.frombuffer(b"".join(images), dtype=np.uint8).reshape(LANES, 32))
+    recorder = ProgramRecorder()
+    for name, *args in OPS:
+        getattr(recorder, name)(*args)
+    batch.execute(recorder.build())
+
+    for lane, image in enumerate(images):
+        scalar = FixedWidthStackMachine(8)
+        scalar.store(0, image)
+        for name, *args in OPS:
+            getattr(scalar, name)(*args)
+        assert batch.lane(lane) == scalar._stack[: scalar._sp].tolist()[::-1]
+
+
+def test_division_by_zero_raises():
+    with pytest.raises(ZeroDivisionError):
+        BatchStackMachine(LANES).const(1).const(0).div()
+
+
+def test_batch_tea_matches_scalar_tea():
+    key = bytes.fromhex("dc9e3ac003ca259f20f6a5ad6ecfbce8")
+    plaintexts = [os.urandom(24) for _ in range(LANES)]
+    batch = batch_tea_encrypt(plaintexts, key, delta=0x13371337, rounds=8)
+    for lane, plaintext in enumerate(plaintexts):
+        scalar = tea_encrypt(plaintext, key, delta=0x13371337, rounds=8)
+        assert batch.lane(lane) == scalar._stack[::-1]
@@ -0,0 +1,24 @@
+from dwarf_opt import check_equivalent, optimize, random_images
+from gen_dwarf import DwarfExpressionBuilder, gen_dwarf
+
+CIPHERTEXT = (0xBE6121B7, 0xDF72C75, 0x731262C, 0x2F89FA84)
+
+
+def test_optimized_gen_dwarf_is_equivalent():
+    original = gen_dwarf.__wrapped__(CIPHERTEXT, optimized=False)
+    optimized = gen_dwarf.__wrapped__(CIPHERTEXT)
+    assert len(optimized) < len(original)
+    stores = [(0x405010, bytes(16)), (0x405280, bytes(16))]
+    check_equivalent(original, optimized, random_images(stores, 8))
+
+
+def test_branches_into_removed_code_are_retargeted():
+    builder = DwarfExpressionBuilder()
+    over, back, end = builder.label(), builder.label(), builder.label()
+    # the branches land on no-ops that get dropped, and on a no-op that follows another
+    builder.lit(1).bra(over).lit(7).place(over).swap().swap().lit(0).bra(back)
+    builder.place(back).dup().drop().over().drop().skip(end).lit(9).place(end).lit(0).plus()
+    original = builder.get_bytes()
+    optimized = optimize(original)
+    assert len(optimized) < len(original)
+    check_equivalent(original, optimized, random_images([], 0, initial_stack=(3, 4)))
@@ -0,0 +1,83 @@
+import mmap
+import shutil
+import struct
+from pathlib import Path
+
+import pytest
+
+from eh_frame import Section, check_binary, iter_cfa, iter_fdes, read_sections
+from gen_chall import compile_chall, dwarf_expression, render
+
+SRC_DIR = Path(__file__).parent
+PC_BEGIN = 0x401000
+
+
+def eh_frame_with_64bit_cie():
+    """Returns (data, fde offset): a CIE in the 64-bit length form and one FDE using it."""
+    cie_body = (
+        struct.pack("<I", 0)  # CIE id
+        + b"\x01zR\x00"  # version 1, augmentation "zR"
+        + b"\x01\x78\x10"  # code align 1, data align -8, return register 16
+        + b"\x01\x1b"  # augmentation data: FDE pointers are pcrel sdata4
+        + b"\x0c\x07\x08"  # def_cfa rsp+8
+    )
+    cie = struct.pack("<IQ", 0xFFFFFFFF, len(cie_body)) + cie_body
+    fde_pos = len(cie)
+    pc_field = fde_pos + 8
+    fde_body = (
+        struct.pack("<I", fde_pos + 4)  # back to the CIE
+        + struct.pack("<iI", PC_BEGIN - (0x1000 + pc_field), 0x20)
+        + b"\x00"  # no augmentation data
+        + b"\x41\x0e\x10"  # advance_loc 1, def_cfa_offset 16
+    )
+    fde = struct.pack("<I", len(fde_body)) + fde_body
+    return cie + fde + bytes(4), fde_pos
+
+
+@pytest.mark.parametrize("start", ["cie", "fde"])
+def test_64bit_cie(start):
+    data, fde_pos = eh_frame_with_64bit_cie()
+    # starting at the FDE leaves its CIE outside the walk, so it is parsed on demand
+    offset = 0 if start == "cie" else fde_pos
+    section = Section(".eh_frame", 0x1000 + offset, offset, len(data) - offset)
+    (fde,) = iter_fdes(data, section)
+    assert fde.cie.augmentation == "zR"
+    assert (fde.cie.code_align, fde.cie.data_align, fde.cie.return_register) == (1, -8, 16)
+    assert bytes(fde.cie.instructions) == b"\x0c\x07\x08"
+    assert (fde.pc_begin, fde.pc_range) == (PC_BEGIN, 0x20)
+    assert [op for _, op, _ in iter_cfa(fde.instructions)] == [0x41, 0x0E]
+
+
+@pytest.fixture(scope="module")
+def chall(tmp_path_factory):
+    if shutil.which("g++") is None:
+        pytest.skip("g++ is not installed")
+    out = tmp_path_factory.mktemp("chall")
+    flag = (SRC_DIR / "flag.txt").read_bytes()
+    with pytest.MonkeyPatch.context() as m:
+        m.chdir(SRC_DIR)
+        source = render(flag)
+    shutil.copy(SRC_DIR / "md5_simd.cpp", out)
+    (out / "chall.cpp").write_text(source)
+    compile_chall(out / "chall.cpp", str(out / "chall"))
+    return out / "chall", flag
+
+
+def fde_ranges(data):
+    """Returns (pc_begin, pc_end) of every FDE, keeping no views into data."""
+    ranges = []
+    for fde in iter_fdes(data, read_sections(data)[".eh_frame"]):
+        list(iter_cfa(fde.instructions))
+        ranges.append((fde.pc_begin, fde.pc_begin + fde.pc_range))
+    return ranges
+
+
+def test_mmap_parser_on_built_chall(chall):
+    path, flag = chall
+    assert check_binary(path, dwarf_expression(flag)) == []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        sections = read_sections(data).values()
+        ranges = fde_ranges(data)
+    assert ranges
+    for begin, end in ranges:
+        assert any(s.addr <= begin < end <= s.addr + s.size for s in sections if s.addr)
@@ -0,0 +1,31 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).parent
+
+# run in a fresh interpreter, where only gen_chall and what render() pulls in are loaded
+SCRIPT = """
+import json
+import sys
+from pathlib import Path
+
+import gen_chall
+
+gen_chall.render(Path("flag.txt").read_bytes())
+here = Path.cwd().resolve()
+loaded = [
+    Path(module.__file__).name
+    for module in list(sys.modules.values())
+    if getattr(module, "__file__", None) and Path(module.__file__).resolve().parent == here
+]
+print(json.dumps([gen_chall.GENERATOR_SOURCES, loaded]))
+"""
+
+
+def test_generator_sources_cover_every_local_module():
+    output = subprocess.check_output([sys.executable, "-c", SCRIPT], cwd=SRC_DIR)
+    sources, loaded = json.loads(output)
+    assert set(loaded) <= set(sources)
+    assert all((SRC_DIR / name).exists() for name in sources)
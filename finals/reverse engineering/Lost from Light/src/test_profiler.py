@@ -0,0 +1,35 @@
+import pytest
+
+from profiler import Profiler
+from stack_machine import FixedWidthStackMachine, StackMachine, tea_encrypt_block_program
+
+KEY = bytes.fromhex("dc9e3ac003ca259f20f6a5ad6ecfbce8")
+
+
+def stack(machine):
+    if isinstance(machine, FixedWidthStackMachine):
+        return machine._stack[: machine._sp].tolist()
+    return machine._stack
+
+
+@pytest.mark.parametrize("machine_type", [StackMachine, FixedWidthStackMachine])
+@pytest.mark.parametrize("jit", [False, True])
+def test_attached_execute_matches_plain_execute(machine_type, jit):
+    program = tea_encrypt_block_program(0x10, 0, delta=0x13371337, rounds=8)
+    machines = []
+    for _ in range(2):
+        machine = machine_type()
+        machine.store(0, KEY)
+        machine.store(0x10, b"ARKAV{th")
+        machines.append(machine)
+    profiler = Profiler()
+    profiler.attach(machines[0]).execute(program, jit=jit)
+    profiler.detach()
+    machines[1].execute(program, jit=jit)
+
+    assert stack(machines[0]) == stack(machines[1])
+    if jit:
+        assert dict(profiler.counts) == {"execute(jit)": 1}
+    else:
+        assert profiler.counts["deref_size"] == 6
+        assert profiler.loaded_bytes == 24
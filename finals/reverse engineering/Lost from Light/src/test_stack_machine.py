@@ -0,0 +1,129 @@
+import pytest
+
+from stack_machine import (
+    FixedWidthStackMachine,
+    ProgramRecorder,
+    StackMachine,
+    jit_compile,
+    perform_round,
+    tea_encrypt_block,
+    tea_encrypt_block_program,
+)
+
+KEY = bytes.fromhex("dc9e3ac003ca259f20f6a5ad6ecfbce8")
+BLOCK = b"ARKAV{th"
+
+
+def run(program, jit, stack=()):
+    machine = StackMachine()
+    machine.store(0, KEY)
+    machine.store(0x10, BLOCK)
+    machine._stack.extend(stack)
+    machine.execute(program, jit=jit)
+    return machine
+
+
+@pytest.mark.parametrize("jit", [False, True])
+def test_program_replays_chained_calls(jit):
+    # a round on a hand-made [sum, v1, v0, k3, k2, k1, k0] state, then a whole block
+    state = [4, 3, 2, 1, 0x9E3779B9, 0xDEADBEEF, 0x1337]
+    chained = run(ProgramRecorder().build(), jit=False, stack=state)
+    perform_round(chained)
+    tea_encrypt_block(chained, 0x10, 0, delta=0x13371337, rounds=8)
+    recorder = ProgramRecorder()
+    perform_round(recorder)
+    tea_encrypt_block(recorder, 0x10, 0, delta=0x13371337, rounds=8)
+    assert run(recorder.build(), jit=jit, stack=state)._stack == chained._stack
+
+
+def test_jit_matches_interpreter_on_tea():
+    program = tea_encrypt_block_program(0x10, 0, delta=0x13371337, rounds=8)
+    assert run(program, jit=True)._stack == run(program, jit=False)._stack
+
+
+def test_jit_matches_interpreter_on_shuffles():
+    program = ProgramRecorder().dup().rot().over().plus().pick(2).swap().minus().mul().xor().build()
+    stack = [3, 5, 7]
+    assert run(program, jit=True, stack=stack)._stack == run(program, jit=False, stack=stack)._stack
+
+
+def test_jit_empty_body():
+    program = ProgramRecorder().const(5).drop().build()
+    assert run(program, jit=True)._stack == run(program, jit=False)._stack == []
+
+
+def test_jit_runs_dropped_loads():
+    program = ProgramRecorder().const(1 << 40).deref().drop().const(3).build()
+    for jit in (False, True):
+        with pytest.raises(ValueError, match="out of bound"):
+            run(program, jit=jit)
+
+
+def test_jit_keeps_load_order():
+    program = ProgramRecorder().const(0x10).deref_size(4).const(1 << 40).deref_size(4).build()
+    loads = []
+
+    def load(addr, size):
+        loads.append(addr)
+        return 0
+
+    jit_compile(program)([], load, 8)
+    assert loads == [0x10, 1 << 40]
+
+
+def test_jit_runs_dropped_divisions():
+    program = ProgramRecorder().div().drop().const(3).build()
+    for jit in (False, True):
+        with pytest.raises(ZeroDivisionError):
+            run(program, jit=jit, stack=[1, 0])
+
+
+# wraps on every op: negative results, signed div and abs, shifts past the word size
+WRAPPING_OPS = [
+    ("const", -5),
+    ("minus",),
+    ("over",),
+    ("neg",),
+    ("div",),
+    ("abs",),
+    ("const", 1 << 70),
+    ("plus",),
+    ("const", 67),
+    ("shl",),
+    ("pick", 1),
+    ("const", 35),
+    ("shr",),
+    ("mul",),
+    ("bnot",),
+    ("const", 0x1234),
+    ("deref_size", 8),
+    ("xor",),
+    ("over",),
+    ("eq",),
+    ("const", 9),
+    ("rot",),
+]
+
+
+@pytest.mark.parametrize("address_size", [4, 8])
+@pytest.mark.parametrize("jit", [False, True])
+def test_fixed_width_execute_matches_chained_calls(address_size, jit):
+    def machine():
+        m = FixedWidthStackMachine(address_size)
+        m.store(0x1230, bytes(range(0x80, 0x90)))
+        return m.const(7).const(3)
+
+    expected = machine()
+    for name, *args in WRAPPING_OPS:
+        getattr(expected, name)(*args)
+    program = ProgramRecorder()
+    for name, *args in WRAPPING_OPS:
+        getattr(program, name)(*args)
+    actual = machine().execute(program.build(), jit=jit)
+    assert actual._stack[: actual._sp] == expected._stack[: expected._sp]
+
+
+@pytest.mark.parametrize("name", ["dup", "over"])
+def test_fixed_width_shuffles_check_depth(name):
+    with pytest.raises(RuntimeError, match="stack must have at least"):
+        getattr(FixedWidthStackMachine(), name)()
@@ -0,0 +1,53 @@
+import pytest
+
+import tea
+
+KEY = bytes.fromhex("dc9e3ac003ca259f20f6a5ad6ecfbce8")
+FLAG = b"ARKAV{this_chall_is_as_treacherous_as_lost_from_light!!}"
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(tea, "np", None)
+    elif tea.np is None:
+        pytest.skip("numpy is not installed")
+    else:
+        # short inputs would take the plain-int path
+        monkeypatch.setattr(tea, "_NUMPY_MIN_BLOCKS", 0)
+    return request.param
+
+
+@pytest.mark.parametrize("delta", [-1, -0x61C88647, (1 << 64) + 0x13371337])
+def test_deltas_wrap_to_32_bits(backend, delta):
+    expected = tea.encrypt(FLAG, KEY, delta & 0xFFFFFFFF, 8)
+    assert tea.encrypt(FLAG, KEY, delta, 8) == expected
+    assert tea.decrypt(expected, KEY, delta, 8) == FLAG
+    assert tea.encrypt_many([FLAG], [KEY], [delta], 8) == [expected]
+    assert tea.decrypt_many([expected], [KEY], [delta], 8) == [FLAG]
+
+
+def test_many_with_no_lanes(backend):
+    assert tea.encrypt_many([], []) == []
+    assert tea.decrypt_many([], KEY) == []
+
+
+def test_many_rejects_mismatched_lanes(backend):
+    with pytest.raises(ValueError, match="same number of entries, got 2, 3 and 1"):
+        tea.encrypt_many([FLAG, FLAG], [KEY] * 3)
+
+
+@pytest.mark.parametrize("size", [0, 8, 13, 120, 128, 200])
+def test_plain_int_and_numpy_paths_agree(monkeypatch, size):
+    if tea.np is None:
+        pytest.skip("numpy is not installed")
+    data = bytes(range(1, size + 1))
+    results = []
+    for min_blocks in (1 << 30, 0):
+        monkeypatch.setattr(tea, "_NUMPY_MIN_BLOCKS", min_blocks)
+        ciphertext = tea.encrypt(data, KEY)
+        stream = b"".join(bytes(view) for view in tea.encrypt_stream([data], KEY, chunk_size=24))
+        results.append((ciphertext, stream, tea.decrypt(ciphertext, KEY)))
+    assert results[0] == results[1]
+    assert results[0][1] == results[0][0]
+    assert results[0][2] == data
@@ -5,7 +5,7 @@ import io
 import os
 import random
 import re
-import select
+import selectors
 import signal
 import struct
 import sys
@@ -15,18 +15,34 @@ import tty
 
 WIDTH = 629
 HEIGHT = 135
+FPS = 30
+# how long an escape sequence may take to arrive in full before its start is taken as typed keys
+ESCAPE_DELAY = 0.05
 KEY_MAP = {
     b"\x1b[A": "up",
     b"\x1b[B": "down",
     b"\x1b[C": "right",
     b"\x1b[D": "left",
+    # the same arrows in application cursor mode
+    b"\x1bOA": "up",
+    b"\x1bOB": "down",
+    b"\x1bOC": "right",
+    b"\x1bOD": "left",
     b"\x03": "ctrl+c",
     b"\x1b": "escape",
 }
+# a whole escape sequence, possibly cut off at the end of the data read so far, or any other
+# byte: CSI with its parameter and intermediate bytes, SS3 with its final byte, or ESC and one
+# byte, such as Alt+key
+TOKEN = re.compile(rb"\x1b(?:\[[0-?]*[ -/]*(?:[@-~]|\Z)|O(?:.|\Z)|.|\Z)|.", re.DOTALL)
+# the start of an escape sequence that the next read may complete
+PARTIAL = re.compile(rb"\x1b(?:\[[0-?]*[ -/]*|O)?")
 
 old_settings = termios.tcgetattr(sys.stdin.fileno())
 player: tuple[int, int]
 tiles: list[list[str]]
+# what print_map last drew: ((rows, cols), status wrapped, status, player's screen row, column)
+last_frame = None
 
 
 def get_terminal_size():
@@ -96,11 +112,12 @@ def exit_raw_mode():
     termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
 
 
-def read_key():
-    rlist, _, _ = select.select([sys.stdin], [], [])
-    if sys.stdin in rlist:
-        return sys.stdin.buffer.read(16)
-    return b""
+# splits data into keys, returning them and an unterminated escape sequence left at its end
+def tokenize(data):
+    keys = [match_result.group() for match_result in TOKEN.finditer(data)]
+    if keys and PARTIAL.fullmatch(keys[-1]):
+        return keys[:-1], keys[-1]
+    return keys, b""
 
 
 def init():
@@ -113,34 +130,44 @@ def fini():
     exit_raw_mode()
 
 
-def handle_input():
+# applies keys in order to a rows x cols terminal, as if each one was read on its own, and
+# returns the resulting terminal size and whether anything changed
+def handle_input(keys, rows, cols):
     global player
 
-    seq = read_key()
-    key = KEY_MAP.get(seq, seq.decode("utf-8", "ignore"))
-    if key == "q" or key == "ctrl+c" or key == "escape":
-        fini()
-        exit()
-    elif key == "up":
-        player = player[0], player[1] - 1
-    elif key == "down":
-        player = player[0], player[1] + 1
-    elif key == "left":
-        player = player[0] - 1, player[1]
-    elif key == "right":
-        player = player[0] + 1, player[1]
-    elif match_result := re.match(r"\x1b\[8;(\d+);(\d+)t", key):
-        rows, cols = match_result.groups()
-        set_terminal_size(int(rows), int(cols))
-    else:
-        return False
-    return True
-
-
-def print_map():
+    size = rows, cols
+    changed = False
+    for seq in keys:
+        key = KEY_MAP.get(seq, seq.decode("utf-8", "ignore"))
+        if key == "q" or key == "ctrl+c" or key == "escape":
+            fini()
+            exit()
+        elif key == "up":
+            player = player[0], player[1] - 1
+        elif key == "down":
+            player = player[0], player[1] + 1
+        elif key == "left":
+            player = player[0] - 1, player[1]
+        elif key == "right":
+            player = player[0] + 1, player[1]
+        elif match_result := re.match(r"\x1b\[8;(\d+);(\d+)t", key):
+            rows, cols = map(int, match_result.groups())
+        else:
+            continue
+        # wrap now, as drawing after every key used to, so later keys move from the same cell
+        wrap_player(rows, cols)
+        changed = True
+    # only the last resize reaches the terminal
+    if (rows, cols) != size:
+        set_terminal_size(rows, cols)
+    return rows, cols, changed
+
+
+# wraps the player around the edges of the part of the map a rows x cols terminal shows and
+# returns that part as (start_x, end_x, start_y, end_y)
+def wrap_player(rows, cols):
     global player
 
-    rows, cols = get_terminal_size()
     start_x = max(0, (WIDTH - cols) // 2)
     end_x = min(WIDTH, start_x + cols)
     start_y = max(0, (HEIGHT - rows) // 2)
@@ -156,21 +183,45 @@ def print_map():
     if player_y >= end_y:
         player_y = start_y
     player = player_x, player_y
+    return start_x, end_x, start_y, end_y
 
-    buffer = io.StringIO()
 
-    buffer.write("\x1b[2J\x1b[H")
-    buffer.write(f"You found {tiles[player_y][player_x]}\r\n")
-    for y in range(start_y, end_y):
-        for x in range(start_x, end_x):
-            if x == player_x and y == player_y:
-                buffer.write("ඞ")
-            else:
-                buffer.write("_")
-        if WIDTH < cols and y < end_y - 1:
-            buffer.write("\r\n")
+def print_map():
+    global last_frame
+
+    rows, cols = get_terminal_size()
+    start_x, end_x, start_y, end_y = wrap_player(rows, cols)
+    player_x, player_y = player
+
+    status = f"You found {tiles[player_y][player_x]}"
+    # a status line that wraps pushes the map down and scrolls it, so such frames are drawn whole
+    wrapped = len(status) > cols
+    screen_y = player_y - start_y + 2
+    screen_x = player_x - start_x + 1
+
+    buffer = io.StringIO()
 
+    if last_frame is None or last_frame[0] != (rows, cols) or last_frame[1] or wrapped:
+        buffer.write("\x1b[2J\x1b[H")
+        buffer.write(f"{status}\r\n")
+        row = "_" * (end_x - start_x)
+        lines = [row] * (end_y - start_y)
+        lines[player_y - start_y] = row[: screen_x - 1] + "ඞ" + row[screen_x:]
+        # a full-width row wraps on its own
+        buffer.write(("\r\n" if WIDTH < cols else "").join(lines))
+    else:
+        _, _, last_status, last_y, last_x = last_frame
+        if status != last_status:
+            buffer.write(f"\x1b[H{status}\x1b[K")
+        if (screen_y, screen_x) != (last_y, last_x):
+            buffer.write(f"\x1b[{last_y};{last_x}H_\x1b[{screen_y};{screen_x}Hඞ")
+        if buffer.tell():
+            # park the cursor after the last cell, where a full redraw leaves it
+            buffer.write(f"\x1b[{end_y - start_y + 1};{end_x - start_x + 1}H")
+
+    last_frame = (rows, cols), wrapped, status, screen_y, screen_x
     sys.stdout.write(buffer.getvalue())
+    sys.stdout.flush()
 
 
 def start():
@@ -184,12 +235,58 @@ def start():
     tiles = init_tiles()
     player = init_player()
 
-    signal.signal(signal.SIGWINCH, lambda signum, frame: print_map())
+    # the handler only has to exist for the wakeup fd to be written; the loop below redraws
+    wakeup_r, wakeup_w = os.pipe()
+    set_non_blocking(wakeup_r)
+    set_non_blocking(wakeup_w)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGWINCH, lambda signum, frame: None)
 
-    print_map()
+    selector = selectors.DefaultSelector()
+    selector.register(sys.stdin.fileno(), selectors.EVENT_READ)
+    selector.register(wakeup_r, selectors.EVENT_READ)
+
+    rows, cols = get_terminal_size()
+    pending = b""
+    pending_at = 0.0
+    dirty = True
+    drawn_at = 0.0
     while True:
-        if handle_input():
+        # read everything that is ready, then draw at most one frame per 1 / FPS seconds
+        deadlines = []
+        if dirty:
+            deadlines.append(drawn_at + 1 / FPS)
+        if pending:
+            deadlines.append(pending_at + ESCAPE_DELAY)
+        timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+        for key, _ in selector.select(timeout):
+            if key.fd == wakeup_r:
+                os.read(wakeup_r, 512)
+                rows, cols = get_terminal_size()
+                dirty = True
+                continue
+            try:
+                data = os.read(sys.stdin.fileno(), 4096)
+            except BlockingIOError:
+                continue
+            if not data:
+                fini()
+                exit()
+            keys, pending = tokenize(pending + data)
+            pending_at = time.monotonic()
+            rows, cols, changed = handle_input(keys, rows, cols)
+            dirty = dirty or changed
+
+        if pending and time.monotonic() >= pending_at + ESCAPE_DELAY:
+            # nothing completed it, so it was typed as is, e.g. a lone escape
+            rows, cols, changed = handle_input([pending], rows, cols)
+            pending = b""
+            dirty = dirty or changed
+
+        if dirty and time.monotonic() >= drawn_at + 1 / FPS:
             print_map()
+            drawn_at = time.monotonic()
+            dirty = False
 
 
 if sys.stdout.isatty():
@@ -0,0 +1,67 @@
+import sys
+import termios
+from pathlib import Path
+
+import pytest
+from mako.template import Template
+
+SRC_DIR = Path(__file__).parent
+
+
+@pytest.fixture
+def chall(monkeypatch):
+    """Runs the rendered challenge without start(), with the terminal calls replaced."""
+    source = Template(filename=str(SRC_DIR / "chall.py.mako")).render(flag="FLAG")
+    source = source[: source.index("\nif sys.stdout.isatty():")]
+    monkeypatch.setattr(sys.stdin, "fileno", lambda: 0)
+    monkeypatch.setattr(termios, "tcgetattr", lambda fd: None)
+    namespace = {"__name__": "chall"}
+    exec(compile(source, "chall.py", "exec"), namespace)
+
+    def exit():
+        raise SystemExit
+
+    namespace["resizes"] = []
+    namespace["set_terminal_size"] = lambda rows, cols: namespace["resizes"].append((rows, cols))
+    namespace["fini"] = lambda: None
+    namespace["exit"] = exit
+    namespace["player"] = namespace["init_player"]()
+    return namespace
+
+
+@pytest.mark.parametrize(
+    "data, keys, pending",
+    [
+        (b"\x1b[Ax", [b"\x1b[A", b"x"], b""),
+        (b"\x1bOA\x1bOB", [b"\x1bOA", b"\x1bOB"], b""),
+        (b"\x1bq\x1bx", [b"\x1bq", b"\x1bx"], b""),
+        (b"\x1b[?1;2c\x1b[<0;3;4M", [b"\x1b[?1;2c", b"\x1b[<0;3;4M"], b""),
+        (b"\x1b[8;24;80t", [b"\x1b[8;24;80t"], b""),
+        (b"a\x1b", [b"a"], b"\x1b"),
+        (b"a\x1b[", [b"a"], b"\x1b["),
+        (b"a\x1b[?1;", [b"a"], b"\x1b[?1;"),
+        (b"a\x1bO", [b"a"], b"\x1bO"),
+    ],
+)
+def test_tokenize(chall, data, keys, pending):
+    assert chall["tokenize"](data) == (keys, pending)
+
+
+def test_escape_sequences_do_not_quit(chall):
+    x, y = chall["player"]
+    keys, pending = chall["tokenize"](b"\x1bOA\x1bOC\x1bq\x1b[?1;2c\x1b[<0;3;4M\x1b[A")
+    assert pending == b""
+    assert chall["handle_input"](keys, 40, 100) == (40, 100, True)
+    assert chall["player"] == (x + 1, y - 2)
+
+
+def test_bare_escape_quits(chall):
+    keys, pending = chall["tokenize"](b"\x1b[B\x1b")
+    with pytest.raises(SystemExit):
+        chall["handle_input"](keys + [pending], 40, 100)
+
+
+def test_only_the_last_resize_is_applied(chall):
+    keys, _ = chall["tokenize"](b"\x1b[8;24;80t\x1b[8;30;90t\x1b[8;40;100t")
+    assert chall["handle_input"](keys, 50, 120) == (40, 100, True)
+    assert chall["resizes"] == [(40, 100)]